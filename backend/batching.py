@@ -0,0 +1,171 @@
+# backend/batching.py
+
+import asyncio
+import time
+
+
+class SchedulerBusyError(Exception):
+    """Raised by `submit` when the request queue is full."""
+
+
+# --------------------------------------------------
+# Micro-batching Inference Scheduler
+# --------------------------------------------------
+class BatchScheduler:
+    """
+    Collects concurrent inference requests into micro-batches.
+
+    Requests are queued by `submit`. A background task takes the first
+    waiting request, then keeps collecting until either `max_batch_size`
+    requests are gathered or `max_wait_ms` has passed, and hands the whole
+    batch to `batch_fn` in one call. Each result is routed back to the
+    request it came from.
+
+    `batch_fn` is a synchronous callable that receives a list of items and
+    returns a list of the same length. An entry that is an Exception is
+    raised to its caller instead of being returned.
+
+    `runner` is an async callable `runner(batch_fn, items)` that executes a
+    batch off the event loop (e.g. `InferenceWorkerPool.run`); up to
+    `max_concurrent_batches` batches are in flight at once. The waiting
+    queue holds at most `max_queue_size` requests, beyond which `submit`
+    raises SchedulerBusyError instead of piling up work.
+
+    `on_dispatch(waits)`, if given, is called with the seconds each request
+    of a batch spent queued, just before the batch is handed to `runner`.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 runner=None, max_concurrent_batches: int = 1, max_queue_size: int = 0, on_dispatch=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        if max_concurrent_batches < 1:
+            raise ValueError("max_concurrent_batches must be at least 1.")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self.runner = runner or _run_in_thread
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_queue_size = max_queue_size
+        self.on_dispatch = on_dispatch
+        self._queue = None
+        self._task = None
+        self._slots = None
+        self._in_flight = set()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting to be batched."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        """Start the background batching loop on the running event loop."""
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the batching loop and fail any requests still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for task in list(self._in_flight):
+            task.cancel()
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batch scheduler stopped."))
+
+    async def submit(self, item, wait: bool = False):
+        """
+        Queue one item for batched processing and wait for its result.
+        With `wait`, a full queue is waited out instead of raising
+        SchedulerBusyError (for background work such as bulk jobs).
+        """
+        if self._task is None:
+            raise RuntimeError("Batch scheduler is not running.")
+        future = asyncio.get_running_loop().create_future()
+        if wait:
+            await self._queue.put((item, future, time.perf_counter()))
+        else:
+            try:
+                self._queue.put_nowait((item, future, time.perf_counter()))
+            except asyncio.QueueFull:
+                raise SchedulerBusyError("Inference queue is full.") from None
+        return await future
+
+    async def _collect_batch(self):
+        """Wait for one request, then gather more until size or time limit."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Drain anything already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free batch slot before collecting, so requests keep
+            # accumulating (and batches grow) while every worker is busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            # Requests cancelled while queued (client went away) are dropped
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                self._slots.release()
+                continue
+            if self.on_dispatch is not None:
+                now = time.perf_counter()
+                self.on_dispatch([now - enqueued for _, _, enqueued in batch])
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            items = [item for item, _, _ in batch]
+            try:
+                outputs = await self.runner(self.batch_fn, items)
+            except Exception as e:
+                outputs = [e] * len(batch)
+
+            for (_, future, _), output in zip(batch, outputs):
+                if future.done():
+                    continue
+                if isinstance(output, Exception):
+                    future.set_exception(output)
+                else:
+                    future.set_result(output)
+        finally:
+            # Never leave a caller waiting, even if this task was cancelled
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Batch scheduler stopped."))
+            self._slots.release()
+
+
+async def _run_in_thread(fn, items):
+    return await asyncio.to_thread(fn, items)
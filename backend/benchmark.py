@@ -0,0 +1,430 @@
+# backend/benchmark.py
+
+"""
+Reproducible latency / throughput benchmark of the inference path.
+
+    python -m backend.benchmark
+    python -m backend.benchmark --mode both --concurrency 1,4 --sizes 1920x1080,4000x3000 --output bench.json
+    python -m backend.benchmark --mode http --url http://127.0.0.1:8000 --response metrics
+    python -m backend.benchmark --output bench_new.json --compare bench_main.json
+
+`inprocess` calls process_egg_tray from `concurrency` threads; `http`
+posts to /predict/ on --url, or on a uvicorn server started for the run.
+Images are `sample_images_for_testing/` plus the samples resized to each
+--sizes entry. Every scenario reports p50 / p95 / p99 latency,
+images per second, the per-stage breakdown from the stage histograms
+(see backend.metrics) and peak RSS, as JSON together with the commit,
+library versions and inference settings, so runs on the same machine are
+comparable across commits. --compare exits with 1 when a scenario's p95
+latency or throughput got worse than --max-regression.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import requests
+import yaml
+
+from backend.metrics import stage_seconds
+from backend.yolo_inference import BASE_DIR, model_manager, params, process_egg_tray
+
+
+SAMPLES_DIR = os.path.join(BASE_DIR, "sample_images_for_testing")
+
+# Inference settings recorded with every run; results are only comparable when they match
+RECORDED_PARAMS = ("inference_backend", "imgsz", "reduced_decode", "tray_layout", "tile_size", "confidence_threshold",
+                   "max_batch_size", "max_wait_ms", "worker_pool_kind", "worker_pool_size", "model_workers",
+                   "result_cache_size")
+
+RESPONSE_QUERY = {"base64": {}, "bytes": {"image_mode": "url"}, "metrics": {"metrics_only": "true"}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark process_egg_tray and POST /predict/.")
+    parser.add_argument("--mode", choices=("inprocess", "http", "both"), default="inprocess")
+    parser.add_argument("--concurrency", default="1", help="comma-separated concurrent callers, e.g. 1,4,8")
+    parser.add_argument("--requests", dest="num_requests", type=int, default=20,
+                        help="timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed requests before each scenario")
+    parser.add_argument("--sizes", default="", help="synthetic image sizes WxH, e.g. 1920x1080,4000x3000")
+    parser.add_argument("--response", choices=tuple(RESPONSE_QUERY), default="base64",
+                        help="response mode, as ?metrics_only / ?image_mode select it")
+    parser.add_argument("--url", help="running API to benchmark (default: start one on a free port)")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.1,
+                        help="allowed relative p95 / throughput change before --compare fails")
+    return parser.parse_args()
+
+
+# --------------------------------------------------
+# Images
+# --------------------------------------------------
+def sample_images():
+    paths = sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.jp*g")) + glob.glob(os.path.join(SAMPLES_DIR, "*.png")))
+    if not paths:
+        raise FileNotFoundError(f"No sample images in {SAMPLES_DIR}.")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    return images
+
+
+def synthetic_images(samples: list, size: str):
+    """The sample images resized to WxH and JPEG-encoded, so eggs stay realistic at any resolution."""
+    width, height = (int(v) for v in size.lower().split("x"))
+    images = []
+    for image_bytes in samples:
+        frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+        ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append(buffer.tobytes())
+    return images
+
+
+def image_sets(sizes: str) -> dict:
+    samples = sample_images()
+    sets = {"samples": samples}
+    for size in filter(None, (s.strip() for s in sizes.split(","))):
+        sets[size] = synthetic_images(samples, size)
+    return sets
+
+
+def uncached(image_bytes: bytes, tag: str) -> bytes:
+    """
+    The same image with a unique trailer after its end marker: decoders
+    ignore it, but the result cache (keyed by content hash) misses.
+    """
+    return image_bytes + b"\0benchmark-" + tag.encode("ascii")
+
+
+# --------------------------------------------------
+# Measurements
+# --------------------------------------------------
+def latency_summary(latencies: list) -> dict:
+    values = np.asarray(latencies) * 1000
+    if len(values) == 0:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2),
+            "mean": round(values.mean(), 2), "max": round(values.max(), 2)}
+
+
+def reset_peak_rss(pid: int):
+    """Restart the kernel's peak-RSS counter (Linux), so each scenario reports its own peak."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid: int):
+    """Peak resident memory of a process in MB (VmHWM on Linux), or None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid == os.getpid():
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    return None
+
+
+def stage_breakdown(sums: dict, counts: dict, num_images: int) -> dict:
+    """Per stage: calls, mean time per call and time per image (batched stages spread over their images)."""
+    return {
+        stage: {
+            "calls": int(counts[stage]),
+            "mean_ms": round(sums[stage] / counts[stage] * 1000, 3),
+            "ms_per_image": round(sums[stage] / num_images * 1000, 3),
+        }
+        for stage in sorted(sums) if counts.get(stage)
+    }
+
+
+_local_sums, _local_counts = {}, {}
+
+
+def local_stages():
+    """(sums, counts) per stage observed in this process so far."""
+    for (stage,), values in stage_seconds.drain().items():
+        _local_sums[stage] = _local_sums.get(stage, 0.0) + values[-1]
+        _local_counts[stage] = _local_counts.get(stage, 0) + sum(values[:-1])
+    return dict(_local_sums), dict(_local_counts)
+
+
+_STAGE_SAMPLE = re.compile(r'^egg_tray_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.MULTILINE)
+
+
+def scraped_stages(url: str):
+    """(sums, counts) per stage from the server's /metrics."""
+    sums, counts = {}, {}
+    for kind, stage, value in _STAGE_SAMPLE.findall(requests.get(f"{url}/metrics", timeout=10).text):
+        (sums if kind == "sum" else counts)[stage] = float(value)
+    return sums, counts
+
+
+def run_load(call, payloads: list, concurrency: int, num_requests: int):
+    """
+    `num_requests` calls of `call(payload)` cycling through `payloads`,
+    `concurrency` at a time. Returns (latencies of successful calls,
+    error messages, wall seconds).
+    """
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(index):
+        start = time.perf_counter()
+        try:
+            call(payloads[index % len(payloads)])
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(num_requests)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_scenario(name: str, call, payloads: list, concurrency: int, args, stages, pid: int) -> dict:
+    """Warm up, then time one load level; `stages()` returns the stage (sums, counts) so far."""
+    run_load(call, payloads, concurrency, args.warmup)
+    before_sums, before_counts = stages()
+    reset_peak_rss(pid)
+
+    latencies, errors, wall = run_load(call, payloads, concurrency, args.num_requests)
+
+    after_sums, after_counts = stages()
+    sums = {stage: value - before_sums.get(stage, 0.0) for stage, value in after_sums.items()}
+    counts = {stage: value - before_counts.get(stage, 0) for stage, value in after_counts.items()}
+    result = {
+        "name": name,
+        "concurrency": concurrency,
+        "requests": args.num_requests,
+        "errors": len(errors),
+        "latency_ms": latency_summary(latencies),
+        "images_per_second": round(len(latencies) / wall, 2) if wall else 0.0,
+        "stages": stage_breakdown(sums, counts, max(len(latencies), 1)),
+        "peak_rss_mb": peak_rss_mb(pid),
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    latency = result["latency_ms"]
+    print(f"{name:45s} p50 {latency.get('p50', '-'):>8} ms  p95 {latency.get('p95', '-'):>8} ms  "
+          f"{result['images_per_second']:>7} img/s  errors {len(errors)}", file=sys.stderr)
+    return result
+
+
+# --------------------------------------------------
+# In-process / HTTP Modes
+# --------------------------------------------------
+def benchmark_inprocess(sets: dict, levels: list, args) -> list:
+    # One model instance per concurrent caller, as the thread worker pool does
+    model_manager.num_instances = max(levels)
+    model_manager.load()
+
+    def call(image_bytes):
+        process_egg_tray(image_bytes, args.response)
+
+    results = []
+    for set_name, payloads in sets.items():
+        for concurrency in levels:
+            name = f"inprocess/{set_name}/{args.response}/c{concurrency}"
+            results.append(run_scenario(name, call, payloads, concurrency, args, local_stages, os.getpid()))
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir: str, timeout: float = 300.0):
+    """
+    A uvicorn process serving backend.main on a free port, once /readyz is
+    green. It reads a copy of the settings in `workdir` with the inspection
+    history disabled, so benchmark trays never reach results.db or the
+    shift rollups.
+    """
+    params_path = os.path.join(workdir, "inference_phams.yaml")
+    with open(params_path, "w") as f:
+        yaml.safe_dump({**params, "results_db_path": ""}, f)
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BASE_DIR, env={**os.environ, "INFERENCE_PARAMS": params_path},
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with code {process.returncode}.")
+        try:
+            if requests.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return process, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("API server did not become ready in time.")
+
+
+def benchmark_http(sets: dict, levels: list, args, url: str, pid) -> list:
+    sessions = threading.local()
+    query = {**RESPONSE_QUERY[args.response], "line": "benchmark"}
+    run_id = uuid.uuid4().hex[:8]
+    sequence = itertools.count()
+
+    def call(image_bytes):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        response = session.post(f"{url}/predict/", params=query,
+                                files={"file": ("tray.jpg", uncached(image_bytes, f"{run_id}-{next(sequence)}"))}, timeout=120)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.json()
+
+    def stages():
+        return scraped_stages(url)
+
+    results = []
+    for set_name, payloads in sets.items():
+        for concurrency in levels:
+            name = f"http/{set_name}/{args.response}/c{concurrency}"
+            # Peak RSS is the API process's (worker processes not included) when it was started here
+            results.append(run_scenario(name, call, payloads, concurrency, args, stages, pid))
+    return results
+
+
+# --------------------------------------------------
+# Report / Regression Check
+# --------------------------------------------------
+def _git(*command):
+    try:
+        return subprocess.run(["git", *command], cwd=BASE_DIR, capture_output=True, text=True,
+                              timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def environment(args, sets: dict) -> dict:
+    import torch
+    import ultralytics
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "ultralytics": ultralytics.__version__,
+        "model_version": model_manager.version,
+        "params": {key: params.get(key) for key in RECORDED_PARAMS},
+        "response": args.response,
+        "requests": args.num_requests,
+        "warmup": args.warmup,
+        "image_sets": {name: {"images": len(images), "bytes": sum(map(len, images))}
+                       for name, images in sets.items()},
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """Scenarios whose p95 latency rose or throughput fell by more than `max_regression`."""
+    if report["environment"]["cpu_count"] != baseline["environment"].get("cpu_count"):
+        print("Warning: baseline was measured on a different machine.", file=sys.stderr)
+    previous = {scenario["name"]: scenario for scenario in baseline["scenarios"]}
+    regressions = []
+    for scenario in report["scenarios"]:
+        old = previous.get(scenario["name"])
+        if old is None or not old["latency_ms"] or not scenario["latency_ms"]:
+            continue
+        p95_change = scenario["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        ips_change = (scenario["images_per_second"] / old["images_per_second"] - 1
+                      if old["images_per_second"] else 0.0)
+        regressed = p95_change > max_regression or ips_change < -max_regression
+        print(f"{scenario['name']:45s} p95 {p95_change:+7.1%}  img/s {ips_change:+7.1%}"
+              f"{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+        if regressed:
+            regressions.append(scenario["name"])
+    return regressions
+
+
+def main():
+    args = parse_args()
+    levels = [int(v) for v in args.concurrency.split(",")]
+    sets = image_sets(args.sizes)
+
+    scenarios = []
+    if args.mode in ("inprocess", "both"):
+        scenarios += benchmark_inprocess(sets, levels, args)
+    if args.mode in ("http", "both"):
+        server = None
+        url = args.url.rstrip("/") if args.url else None
+        workdir = tempfile.TemporaryDirectory()
+        if url is None:
+            server, url = start_server(workdir.name)
+        else:
+            print(f"Note: {url} stores benchmark trays under line=benchmark; they count towards "
+                  f"/rollups/current-shift.", file=sys.stderr)
+        try:
+            scenarios += benchmark_http(sets, levels, args, url, server.pid if server else None)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(30)
+            workdir.cleanup()
+
+    report = {"environment": environment(args, sets), "scenarios": scenarios}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} scenario(s) regressed.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# backend/bulk_inspect.py
+
+"""
+Re-inspect an archive of tray photos in-process, without one HTTP round
+trip per image.
+
+    python -m backend.bulk_inspect /data/trays/2025-05-23/
+    python -m backend.bulk_inspect trays.zip --output audit.ndjson --batch-size 32
+
+One NDJSON line per image is appended to --output. Running the same
+command again after an interruption skips the images already listed there.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from backend.bulk_inspection import BulkProgress, inspect_images, iter_images
+from backend.yolo_inference import model_manager, params, process_egg_tray_batch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect every tray image in a directory, ZIP or tar archive.")
+    parser.add_argument("source", help="directory, .zip or .tar(.gz) of tray images")
+    parser.add_argument("--output", help="NDJSON results / progress file (default: <source>_results.ndjson)")
+    parser.add_argument("--batch-size", type=int, default=params.get("bulk_batch_size", 16),
+                        help="images per batched model call")
+    parser.add_argument("--in-flight", type=int, default=params.get("bulk_max_in_flight", 2),
+                        help="batches decoding / running at once")
+    parser.add_argument("--include-detections", action="store_true", help="also write boxes and confidences")
+    parser.add_argument("--report-every", type=int, default=500, help="print progress every N images")
+    return parser.parse_args()
+
+
+async def run(args):
+    images = iter_images(args.source)
+    progress = BulkProgress(args.output)
+    if progress.done:
+        print(f"Resuming: {len(progress.done)} images already in {args.output}", file=sys.stderr)
+
+    async def infer_batch(images_bytes):
+        return await asyncio.to_thread(process_egg_tray_batch, images_bytes, "metrics")
+
+    summary = None
+    count = 0
+    try:
+        async for record in inspect_images(images, infer_batch, progress, batch_size=args.batch_size,
+                                           max_in_flight=args.in_flight,
+                                           include_detections=args.include_detections):
+            if record.get("done"):
+                summary = record
+                continue
+            if "error" in record:
+                print(f"{record['name']}: {record['error']}", file=sys.stderr)
+            count += 1
+            if args.report_every and count % args.report_every == 0:
+                print(f"{count} images inspected", file=sys.stderr)
+    finally:
+        progress.close()
+    return summary
+
+
+def main():
+    args = parse_args()
+    if not args.output:
+        args.output = os.path.basename(os.path.normpath(args.source)).split(".")[0] + "_results.ndjson"
+
+    # Batches decode before they take a model, so one model fewer than batches in flight keeps it busy
+    model_manager.num_instances = max(args.in_flight - 1, 1)
+    model_manager.load()
+
+    try:
+        summary = asyncio.run(run(args))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+# backend/bulk_inspection.py
+
+import asyncio
+import json
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def is_image_name(name: str) -> bool:
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith(".")
+
+
+def clean_name(name: str) -> str:
+    """Archive member name without a leading "./", so every source names an image alike."""
+    while name.startswith("./"):
+        name = name[2:]
+    return name
+
+
+# --------------------------------------------------
+# Image Sources: Directory / ZIP / tar
+# --------------------------------------------------
+def iter_directory(path: str):
+    """(relative name, bytes) of every image below a directory, in sorted order."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            if is_image_name(file_name):
+                full_path = os.path.join(root, file_name)
+                with open(full_path, "rb") as f:
+                    yield os.path.relpath(full_path, path).replace(os.sep, "/"), f.read()
+
+
+def iter_zip(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and is_image_name(info.filename):
+                yield clean_name(info.filename), archive.read(info)
+
+
+def iter_tar(fileobj):
+    # Streaming mode: members are read in archive order without seeking back
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and is_image_name(member.name):
+                yield clean_name(member.name), archive.extractfile(member).read()
+
+
+def _archive_reader(fileobj):
+    """iter_zip or iter_tar, whichever can read this file."""
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return iter_zip
+    fileobj.seek(0)
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r:*"):
+            pass
+    except tarfile.TarError:
+        raise ValueError("Expected a directory, a ZIP file or a tar archive.")
+    fileobj.seek(0)
+    return iter_tar
+
+
+def _iter_archive_path(path: str, reader):
+    with open(path, "rb") as f:
+        yield from reader(f)
+
+
+def iter_images(source):
+    """
+    (name, image bytes) for every image in a directory path, a ZIP / tar
+    (.tar, .tar.gz, .tgz, ...) path, or an open seekable archive file.
+    Raises ValueError for anything else.
+    """
+    if not isinstance(source, str):
+        return _archive_reader(source)(source)
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if not os.path.isfile(source):
+        raise ValueError(f"{source} is neither a directory nor an archive.")
+    with open(source, "rb") as f:
+        reader = _archive_reader(f)
+    return _iter_archive_path(source, reader)
+
+
+# --------------------------------------------------
+# Resumable Progress
+# --------------------------------------------------
+class BulkProgress:
+    """
+    Append-only NDJSON file holding one result line per finished image.
+    Re-opening the same file skips the images it already lists, so an
+    interrupted audit resumes where it stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        cut_short = False
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    cut_short = not line.endswith("\n")
+                    try:
+                        self.done.add(json.loads(line)["name"])
+                    except (ValueError, KeyError):
+                        continue  # a line cut short by the interruption
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        if cut_short:
+            self._file.write("\n")
+
+    def write(self, records: list):
+        if self._file is None:
+            return
+        self._file.writelines(json.dumps(record) + "\n" for record in records)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# --------------------------------------------------
+# Batched, Pipelined Inspection
+# --------------------------------------------------
+def _read_batch(images, batch_size: int, skip: set):
+    """Next batch of (name, bytes) not finished yet; [] at the end, plus the skipped count."""
+    batch, skipped = [], 0
+    for name, image_bytes in images:
+        if name in skip:
+            skipped += 1
+            continue
+        batch.append((name, image_bytes))
+        if len(batch) == batch_size:
+            break
+    return batch, skipped
+
+
+def to_record(name: str, result, include_detections: bool = False) -> dict:
+    if isinstance(result, Exception):
+        return {"name": name, "error": str(result)}
+    record = {"name": name, **result}
+    if not include_detections:
+        record.pop("detections", None)
+    return record
+
+
+async def inspect_images(images, infer_batch, progress: BulkProgress = None, batch_size: int = 16,
+                         max_in_flight: int = 2, include_detections: bool = False):
+    """
+    Async generator of one record per image: {"name", "num_eggs",
+    "num_empty_slots", "tray_status"} or {"name", "error"}, followed by a
+    final {"done": true, ...} summary.
+
+    Images are read off the event loop in batches of `batch_size`; each
+    batch goes to `infer_batch(list of bytes)` (decode + one batched model
+    call), with up to `max_in_flight` batches running while the next one is
+    read. Records come out in source order and are appended to `progress`
+    as each batch finishes; images already listed there are skipped.
+    """
+    images = iter(images)
+    skip = progress.done if progress is not None else set()
+    in_flight = deque()
+    processed = failed = skipped = 0
+    start = time.perf_counter()
+    exhausted = False
+
+    try:
+        while not exhausted or in_flight:
+            # Keep the pipeline full: read and submit until max_in_flight batches run
+            while not exhausted and len(in_flight) < max_in_flight:
+                batch, batch_skipped = await asyncio.to_thread(_read_batch, images, batch_size, skip)
+                skipped += batch_skipped
+                if not batch:
+                    exhausted = True
+                    break
+                names = [name for name, _ in batch]
+                task = asyncio.ensure_future(infer_batch([image_bytes for _, image_bytes in batch]))
+                in_flight.append((names, task))
+            if not in_flight:
+                break
+
+            names, task = in_flight.popleft()
+            results = await task
+            records = [to_record(name, result, include_detections) for name, result in zip(names, results)]
+            if progress is not None:
+                await asyncio.to_thread(progress.write, records)
+            for record in records:
+                processed += 1
+                failed += "error" in record
+                yield record
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+
+    elapsed = time.perf_counter() - start
+    yield {
+        "done": True,
+        "processed": processed,
+        "failed": failed,
+        "skipped": skipped,
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(processed / elapsed, 2) if elapsed else 0.0,
+    }
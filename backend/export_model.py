@@ -0,0 +1,67 @@
+# backend/export_model.py
+
+"""
+Export the trained PyTorch weights for a faster CPU inference backend and
+check that the export detects the same eggs as the original.
+
+    python -m backend.export_model --backend onnx
+    python -m backend.export_model --backend openvino --check
+
+Set `inference_backend` in inference_phams.yaml to serve the export.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from backend.inference_backends import compare_backends, export_model
+from backend.yolo_inference import BASE_DIR, params, traind_model_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export YOLO weights for ONNX Runtime / OpenVINO.")
+    configured = params.get("inference_backend", "torch")
+    parser.add_argument("--backend", choices=["onnx", "openvino"],
+                        default=configured if configured in ("onnx", "openvino") else "onnx")
+    parser.add_argument("--weights", default=traind_model_path, help="PyTorch weights to export")
+    parser.add_argument("--imgsz", type=int, default=params.get("imgsz", 640))
+    parser.add_argument("--batch", type=int, default=params.get("max_batch_size", 8),
+                        help="largest batch the exported model accepts")
+    parser.add_argument("--check", action="store_true", help="compare detections against the PyTorch weights")
+    parser.add_argument("--images", default=os.path.join(BASE_DIR, "sample_images_for_testing"),
+                        help="directory of images used for the parity check")
+    parser.add_argument("--min-recall", type=float, default=0.98,
+                        help="fail when fewer PyTorch detections are matched by the export")
+    parser.add_argument("--max-count-mismatches", type=int, default=0,
+                        help="fail when more images get different egg / empty counts")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    exported = export_model(args.weights, args.backend, imgsz=args.imgsz, batch=args.batch)
+    print(f"Exported {args.weights} -> {exported}")
+    if not args.check:
+        return 0
+
+    images = sorted(glob.glob(os.path.join(args.images, "*.jpg")) + glob.glob(os.path.join(args.images, "*.png")))
+    if not images:
+        print(f"No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    report = compare_backends(
+        args.weights, exported, images,
+        conf=params.get("confidence_threshold", 0.5),
+        classes=params.get("classes_to_track"),
+    )
+    print(json.dumps(report, indent=2))
+
+    ok = report["recall"] >= args.min_recall and report["count_mismatches"] <= args.max_count_mismatches
+    print("Parity check " + ("passed" if ok else "FAILED"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
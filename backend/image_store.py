@@ -0,0 +1,50 @@
+# backend/image_store.py
+
+import time
+import uuid
+from collections import OrderedDict
+
+
+# --------------------------------------------------
+# Annotated Image Store
+# --------------------------------------------------
+class AnnotatedImageStore:
+    """
+    Keeps recently rendered annotated images in memory, keyed by a result ID,
+    so clients can fetch them as raw bytes from /results/{id}/image instead
+    of receiving base64 inside the JSON response.
+
+    Oldest entries are dropped once `max_items` is exceeded or after
+    `ttl_seconds`. Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_items: int = 256, ttl_seconds: float = 300):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+
+    def put(self, image: bytes, media_type: str) -> str:
+        """Store one encoded image and return its result ID."""
+        self._evict_expired()
+        result_id = uuid.uuid4().hex
+        self._items[result_id] = (time.monotonic(), image, media_type)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        return result_id
+
+    def get(self, result_id: str):
+        """Return (image bytes, media type), or None if unknown or expired."""
+        self._evict_expired()
+        entry = self._items.get(result_id)
+        if entry is None:
+            return None
+        _, image, media_type = entry
+        return image, media_type
+
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._items:
+            oldest_id, (created, _, _) = next(iter(self._items.items()))
+            if created >= cutoff:
+                break
+            del self._items[oldest_id]
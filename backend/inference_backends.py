@@ -0,0 +1,171 @@
+# backend/inference_backends.py
+
+import os
+
+import numpy as np
+from ultralytics import YOLO
+
+
+# Inference backends selectable with `inference_backend` in inference_phams.yaml.
+# ultralytics' AutoBackend runs every one of these formats through the same
+# YOLO.predict / YOLO.track API, so only the weights file changes.
+# The *_int8 variants are produced (and accuracy-gated) by src/model_quantization.py.
+BACKENDS = {
+    "torch": {"format": None, "suffix": ".pt"},
+    "onnx": {"format": "onnx", "suffix": ".onnx"},                   # ONNX Runtime (CPU)
+    "openvino": {"format": "openvino", "suffix": "_openvino_model"},  # Intel OpenVINO (CPU)
+    "onnx_int8": {"format": "onnx", "suffix": "_int8.onnx", "int8": True},
+    "openvino_int8": {"format": "openvino", "suffix": "_int8_openvino_model", "int8": True},
+}
+
+
+def _check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Use one of: {', '.join(BACKENDS)}.")
+
+
+def exported_weights_path(weights_path: str, backend: str) -> str:
+    """Where the export of `weights_path` for `backend` lives (next to the .pt file)."""
+    _check_backend(backend)
+    if backend == "torch":
+        return weights_path
+    stem, _ = os.path.splitext(weights_path)
+    return stem + BACKENDS[backend]["suffix"]
+
+
+def export_model(weights_path: str, backend: str, imgsz: int = 640, batch: int = 8) -> str:
+    """
+    Export PyTorch weights to `backend` with a dynamic batch dimension
+    (up to `batch` images per call) and return the exported path.
+    """
+    _check_backend(backend)
+    if backend == "torch":
+        return weights_path
+    if BACKENDS[backend].get("int8"):
+        raise ValueError(f"{backend} weights need calibration data. Run: python src/model_quantization.py")
+
+    model = YOLO(weights_path)
+    exported = model.export(format=BACKENDS[backend]["format"], imgsz=imgsz, dynamic=True, batch=batch)
+    return str(exported)
+
+
+def ensure_exported(weights_path: str, backend: str, imgsz: int = 640, batch: int = 8) -> str:
+    """
+    Return the weights to load for `backend`, exporting first when the export
+    is missing or older than the PyTorch weights it was made from.
+    """
+    target = exported_weights_path(weights_path, backend)
+    if backend == "torch":
+        return target
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights_path):
+        return target
+    return export_model(weights_path, backend, imgsz=imgsz, batch=batch)
+
+
+def select_weights(weights_path: str, backend: str) -> str:
+    """
+    Resolve the weights to load for `backend` without exporting.
+    Raises FileNotFoundError with the export command when it is missing.
+    """
+    target = exported_weights_path(weights_path, backend)
+    if not os.path.exists(target):
+        raise FileNotFoundError(
+            f"No {backend} export found at {target}. "
+            f"Run: python -m backend.export_model --backend {backend}"
+        )
+    return target
+
+
+# --------------------------------------------------
+# Parity Check Between Backends
+# --------------------------------------------------
+def box_iou(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy arrays."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(br - tl, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).clip(0).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).clip(0).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match_detections(reference, candidate, iou_threshold: float = 0.5):
+    """
+    Greedily match same-class boxes between two result sets by IoU.
+    Returns a list of (reference index, candidate index, iou).
+    """
+    ref_boxes = reference.boxes.xyxy.cpu().numpy()
+    ref_cls = reference.boxes.cls.cpu().numpy().astype(int)
+    cand_boxes = candidate.boxes.xyxy.cpu().numpy()
+    cand_cls = candidate.boxes.cls.cpu().numpy().astype(int)
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        return []
+
+    iou = box_iou(ref_boxes, cand_boxes)
+    iou[ref_cls[:, None] != cand_cls[None, :]] = 0
+
+    matches = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        matches.append((int(i), int(j), float(iou[i, j])))
+        iou[i, :] = 0
+        iou[:, j] = 0
+    return matches
+
+
+def compare_backends(reference_weights: str, candidate_weights: str, images: list, conf: float = 0.5,
+                     classes=None, iou_threshold: float = 0.5) -> dict:
+    """
+    Run the same images through two weights files (e.g. best.pt vs best.onnx)
+    and report how closely their detections agree.
+    """
+    reference_model = YOLO(reference_weights, task="detect")
+    candidate_model = YOLO(candidate_weights, task="detect")
+
+    per_image = []
+    total_ref = total_cand = total_matched = 0
+    count_mismatches = 0
+    ious, conf_diffs = [], []
+
+    for image in images:
+        reference = reference_model.predict(image, conf=conf, classes=classes, verbose=False)[0]
+        candidate = candidate_model.predict(image, conf=conf, classes=classes, verbose=False)[0]
+        matches = match_detections(reference, candidate, iou_threshold)
+
+        ref_counts = np.bincount(reference.boxes.cls.cpu().numpy().astype(int), minlength=len(reference.names))
+        cand_counts = np.bincount(candidate.boxes.cls.cpu().numpy().astype(int), minlength=len(reference.names))
+        counts_equal = bool(np.array_equal(ref_counts, cand_counts))
+        count_mismatches += not counts_equal
+
+        ref_conf = reference.boxes.conf.cpu().numpy()
+        cand_conf = candidate.boxes.conf.cpu().numpy()
+        for i, j, iou in matches:
+            ious.append(iou)
+            conf_diffs.append(abs(float(ref_conf[i]) - float(cand_conf[j])))
+
+        total_ref += len(reference.boxes)
+        total_cand += len(candidate.boxes)
+        total_matched += len(matches)
+        per_image.append({
+            "image": str(image),
+            "reference_detections": len(reference.boxes),
+            "candidate_detections": len(candidate.boxes),
+            "matched": len(matches),
+            "counts_equal": counts_equal,
+        })
+
+    return {
+        "reference": reference_weights,
+        "candidate": candidate_weights,
+        "images": len(images),
+        "recall": total_matched / total_ref if total_ref else 1.0,
+        "precision": total_matched / total_cand if total_cand else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "max_conf_diff": float(np.max(conf_diffs)) if conf_diffs else None,
+        "count_mismatches": count_mismatches,
+        "per_image": per_image,
+    }
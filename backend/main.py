@@ -1,8 +1,220 @@
-from fastapi import FastAPI, File, UploadFile
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from fastapi import Body, FastAPI, File, Header, HTTPException, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from backend.yolo_inference  import process_egg_tray
+from fastapi.responses import JSONResponse, StreamingResponse
+from backend.batching import BatchScheduler, SchedulerBusyError
+from backend.bulk_inspection import BulkProgress, inspect_images, iter_images
+from backend.image_store import AnnotatedImageStore
+from backend.metrics import (batch_size, merge_worker_metrics, render, request_seconds, requests_total,
+                             stage_seconds, timed, with_worker_metrics)
+from backend.model_manager import model_fingerprint, resolve_weights
+from backend.model_workers import ImageTooLargeError, ModelProcessPool, PoolBusyError
+from backend.result_cache import ResultCache
+from backend.results_store import ResultsStore
+from backend.worker_pool import InferenceWorkerPool
+from backend.inference_backends import ensure_exported
+from backend.yolo_inference  import (BASE_DIR, inference_backend, init_worker, model_manager, params, ping,
+                                     process_tray_requests, traind_model_path)
+
+logger = logging.getLogger(__name__)
+
+worker_pool_kind = params.get("worker_pool_kind", "thread")
+
+# Annotated images served by /results/{id}/image
+image_store = AnnotatedImageStore(
+    max_items=params.get("result_store_size", 256),
+    ttl_seconds=params.get("result_ttl_seconds", 300),
+)
+
+# Repeated uploads of the same tray are answered without inference
+result_cache = ResultCache(
+    max_entries=params.get("result_cache_size", 512),
+    max_bytes=int(params.get("result_cache_mb", 256) * 1024 * 1024),
+    ttl_seconds=params.get("result_cache_ttl_seconds", 600),
+)
+
+# Every inspection is persisted by a write-behind SQLite writer ("" disables it)
+results_store = ResultsStore(
+    os.path.join(BASE_DIR, params["results_db_path"]) if params.get("results_db_path") else "",
+    shift_starts=params.get("shift_starts"),
+    batch_size=params.get("results_batch_size", 256),
+    flush_seconds=params.get("results_flush_seconds", 1.0),
+    max_queue_size=params.get("results_queue_size", 10000),
+)
+
+
+def observe_queue_waits(waits: list):
+    for wait in waits:
+        stage_seconds.observe(wait, "queue_wait")
+
+
+async def run_on_pool(fn, *args):
+    """Run `fn(*args)` on the worker pool; process workers send their stage timings back with the result."""
+    if worker_pool.kind == "process":
+        result, drained = await worker_pool.run(with_worker_metrics, fn, *args)
+        merge_worker_metrics(drained)
+        return result
+    return await worker_pool.run(fn, *args)
+
+
+if worker_pool_kind == "shared_memory":
+    # Pre-warmed model processes fed through shared-memory slots
+    model_pool = ModelProcessPool(
+        model_manager.model_path,
+        num_workers=params.get("model_workers"),
+        slots_per_worker=params.get("shm_slots_per_worker", 4),
+        slot_mb=params.get("shm_slot_mb", 8),
+        pin_workers=params.get("pin_model_workers", True),
+        threads_per_worker=params.get("model_worker_threads", 1),
+        warmup_runs=params.get("warmup_runs", 1),
+        max_batch_size=params.get("max_batch_size", 8),
+        job_timeout=params.get("job_timeout_seconds", 30),
+        on_dispatch=observe_queue_waits,
+        max_restarts=params.get("model_worker_max_restarts", 5),
+    )
+    worker_pool = None
+    scheduler = None
+else:
+    model_pool = None
+
+    # Decode, YOLO forward, drawing and encoding all run on this bounded pool
+    worker_pool = InferenceWorkerPool(
+        kind=worker_pool_kind,
+        max_workers=params.get("worker_pool_size", 2),
+        initializer=init_worker,
+    )
+
+    # One model instance per worker thread, all loaded and warmed up front
+    model_manager.num_instances = worker_pool.max_workers
+
+    # Group concurrent uploads into one batched predict call
+    scheduler = BatchScheduler(
+        process_tray_requests,
+        max_batch_size=params.get("max_batch_size", 8),
+        max_wait_ms=params.get("max_wait_ms", 10),
+        runner=run_on_pool,
+        max_concurrent_batches=worker_pool.max_workers,
+        max_queue_size=params.get("max_queue_size", 64),
+        on_dispatch=observe_queue_waits,
+    )
+
+
+# Readiness of the inference backend, reported by /readyz
+service_state = {"state": "starting", "error": None}
+
 
-app = FastAPI()
+async def warm_up_models():
+    """Load and warm the models in the background so /healthz answers meanwhile."""
+    service_state["state"] = "warming"
+    try:
+        if model_pool is not None:
+            await model_pool.start()
+        elif worker_pool.kind == "process":
+            await worker_pool.warm_up(ping)
+        else:
+            await asyncio.to_thread(model_manager.load)
+    except Exception as e:
+        logger.exception("Model warm-up failed")
+        service_state["state"] = "failed"
+        service_state["error"] = str(e)
+        return
+    service_state["state"] = "ready"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if results_store.enabled:
+        results_store.start()
+    if model_pool is None:
+        worker_pool.start()
+        await scheduler.start()
+    warm_up_task = asyncio.create_task(warm_up_models())
+    watch_task = None
+    if params.get("model_watch_interval_seconds", 0) > 0:
+        watch_task = asyncio.create_task(watch_weights_file(params["model_watch_interval_seconds"]))
+    yield
+    warm_up_task.cancel()
+    if watch_task is not None:
+        watch_task.cancel()
+    if model_pool is not None:
+        await model_pool.stop()
+    else:
+        await scheduler.stop()
+        worker_pool.shutdown()
+    if results_store.enabled:
+        await asyncio.to_thread(results_store.stop)
+
+
+# --------------------------------------------------
+# Model Registry (zero-downtime reload)
+# --------------------------------------------------
+reload_state = {"state": "idle", "source": None, "error": None}
+background_tasks = set()
+
+
+async def swap_model(source: str):
+    """
+    Load new weights (a file path or MLflow artifact URI) in the background,
+    export them for the configured inference backend if needed, warm them
+    up and swap them in while the current model keeps serving.
+    In-flight requests finish on the model they started with.
+    """
+    reload_state.update(state="loading", source=source, error=None)
+    try:
+        weights_path = await asyncio.to_thread(resolve_weights, source, BASE_DIR)
+        weights_path = await asyncio.to_thread(
+            ensure_exported, weights_path, inference_backend,
+            params.get("imgsz", 640), params.get("max_batch_size", 8),
+        )
+        if model_pool is not None:
+            await model_pool.reload(weights_path)
+            model_manager.model_path = weights_path
+        elif worker_pool.kind == "process":
+            await worker_pool.replace(ping, initargs=(weights_path,))
+            model_manager.model_path = weights_path
+        else:
+            await asyncio.to_thread(model_manager.reload, weights_path)
+    except Exception as e:
+        logger.exception("Model reload from %s failed", source)
+        reload_state.update(state="failed", error=str(e))
+        return
+
+    # Cache keys include the model version, but old entries are now dead weight
+    result_cache.clear()
+    reload_state.update(state="done")
+    logger.info("Swapped in model %s", weights_path)
+
+
+async def watch_weights_file(interval: float):
+    """Reload automatically when the trained weights file changes on disk."""
+    watched_path = traind_model_path
+    last_version = model_fingerprint(watched_path)
+    while True:
+        await asyncio.sleep(interval)
+        if service_state["state"] != "ready" or reload_state["state"] == "loading":
+            continue
+        try:
+            version = model_fingerprint(watched_path)
+        except OSError:
+            continue
+        if version != last_version:
+            last_version = version
+            await swap_model(watched_path)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for Streamlit
 app.add_middleware(
@@ -12,13 +224,351 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+async def run_inference(image_bytes: bytes, output: str = "base64"):
+    """Hand one upload to whichever worker backend is configured."""
+    if model_pool is not None:
+        return await model_pool.infer(image_bytes, output)
+    return await scheduler.submit((image_bytes, output))
+
+
+# Bulk jobs share the scheduler queue / shared-memory slots with /predict/ but never hold more than this
+bulk_capacity = asyncio.Semaphore(params.get("bulk_max_images", 8))
+
+
+async def _bulk_infer(image_bytes: bytes):
+    """One bulk image: waits for capacity instead of failing with 503, without polling."""
+    async with bulk_capacity:
+        if model_pool is not None:
+            return await model_pool.infer(image_bytes, "metrics", wait=True)
+        return await scheduler.submit((image_bytes, "metrics"), wait=True)
+
+
+async def run_bulk_batch(images_bytes: list):
+    """
+    Metrics for one bulk batch. Images go through the same bounded queue
+    (or shared-memory slots) as /predict/, where they are batched with
+    interactive requests; at most `bulk_max_images` of them at a time, so
+    the rest of the capacity stays free for /predict/. An image that fails
+    (e.g. too large for a slot) becomes an error record of its own.
+    """
+    return await asyncio.gather(*(_bulk_infer(image_bytes) for image_bytes in images_bytes),
+                                return_exceptions=True)
+
+
 @app.post("/predict/")
-async def predict(file: UploadFile = File(...)):
+async def predict(file: UploadFile = File(...), metrics_only: bool = False,
+                  image_mode: Literal["base64", "url"] = "base64", line: str = None, tray_id: str = None):
+    """
+    Detect eggs & empty slots in one uploaded tray image.
+
+    `?metrics_only=true` returns counts, boxes and confidences as compact
+    JSON and skips drawing, JPEG encoding and base64 entirely (for PLC
+    integrations that do not display the image).
+
+    `?image_mode=url` keeps the annotated image out of the JSON: the
+    response carries a `result_id` and `annotated_image_url`, and the raw
+    JPEG/WebP bytes are served from GET /results/{result_id}/image.
+
+    Every inspection is stored for the dashboard under `line` (default
+    `production_line`) and `tray_id` (e.g. a scanned barcode; defaults to
+    the inspection ID). Both IDs are returned in the response; an image
+    answered from the result cache is not stored again.
+    """
+    start = time.perf_counter()
+
+    # Only accept traffic once the models are warm
+    if service_state["state"] != "ready":
+        requests_total.inc("not_ready")
+        raise HTTPException(
+            status_code=503,
+            detail="Model is not ready yet.",
+            headers={"Retry-After": str(params.get("retry_after_seconds", 1))},
+        )
+
+    if metrics_only:
+        output = "metrics"
+    elif image_mode == "url":
+        output = "bytes"
+    else:
+        output = "base64"
+
     # Read file bytes
-    image_bytes = await file.read()
+    with timed("read"):
+        image_bytes = await file.read()
+
+    # Serve repeated images from the cache
+    cache_key = None
+    result = None
+    if result_cache.enabled:
+        with timed("cache_lookup"):
+            cache_key = ResultCache.make_key(image_bytes, model_manager.version, params, output)
+            result = result_cache.get(cache_key)
+    cached = result is not None
 
-    # Run backend logic
-    result = process_egg_tray(image_bytes)
+    # Run backend logic off the event loop
+    if result is None:
+        try:
+            result = await run_inference(image_bytes, output)
+        except (SchedulerBusyError, PoolBusyError):
+            requests_total.inc("busy")
+            raise HTTPException(
+                status_code=503,
+                detail="Inference queue is full, retry later.",
+                headers={"Retry-After": str(params.get("retry_after_seconds", 1))},
+            )
+        except asyncio.TimeoutError:
+            requests_total.inc("timeout")
+            raise HTTPException(status_code=504, detail="Inference timed out.")
+        except ImageTooLargeError as e:
+            requests_total.inc("too_large")
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception:
+            requests_total.inc("error")
+            raise
 
-    # Return JSON with metrics and base64 image
+        # Queue the inspection for the results store; never waits on disk. A cache hit is the same
+        # tray sent again, so it is not recorded twice and keeps the IDs of its first inspection.
+        if results_store.enabled:
+            with timed("record"):
+                result.update(results_store.record(
+                    result,
+                    line=line or params.get("production_line", "line-1"),
+                    tray_id=tray_id,
+                    model_version=model_manager.version,
+                    image_hash=hashlib.blake2b(image_bytes, digest_size=16).hexdigest(),
+                ))
+
+        if cache_key is not None:
+            result_cache.put(cache_key, result)
+
+    if output == "bytes":
+        image = result.pop("annotated_image")
+        result_id = image_store.put(image, result.pop("media_type"))
+        result["result_id"] = result_id
+        result["annotated_image_url"] = f"/results/{result_id}/image"
+
+    requests_total.inc("ok")
+    request_seconds.observe(time.perf_counter() - start, output, "true" if cached else "false")
+
+    # Return JSON with metrics and base64 image (or image URL)
     return result
+
+
+@app.post("/bulk/")
+async def bulk_inspect(file: UploadFile = File(None), path: str = None, job_id: str = None,
+                       include_detections: bool = False):
+    """
+    Inspect every image of a ZIP / tar upload, or of a server directory
+    `path` below `bulk_input_root`, streaming one NDJSON line per image as
+    batches finish. The first line carries the `job_id`; sending the same
+    archive again with `?job_id=` skips the images already inspected.
+    """
+    if service_state["state"] != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail="Model is not ready yet.",
+            headers={"Retry-After": str(params.get("retry_after_seconds", 1))},
+        )
+    if (file is None) == (path is None):
+        raise HTTPException(status_code=400, detail="Send either an archive upload or a directory path.")
+    job_id = job_id or uuid.uuid4().hex
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", job_id):
+        raise HTTPException(status_code=400, detail="job_id may only contain letters, digits, '-' and '_'.")
+
+    archive = None
+    if path is not None:
+        root = params.get("bulk_input_root")
+        if not root:
+            raise HTTPException(status_code=403, detail="Directory jobs are disabled (bulk_input_root).")
+        root = os.path.realpath(os.path.join(BASE_DIR, root))
+        source = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, source]) != root:
+            raise HTTPException(status_code=403, detail="Path is outside bulk_input_root.")
+    else:
+        # Own copy of the upload: it must outlive the request handler while the response streams
+        archive = tempfile.TemporaryFile()
+        await asyncio.to_thread(shutil.copyfileobj, file.file, archive)
+        source = archive
+
+    try:
+        images = await asyncio.to_thread(iter_images, source)
+    except ValueError as e:
+        if archive is not None:
+            archive.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    jobs_dir = os.path.join(BASE_DIR, params.get("bulk_jobs_dir", "bulk_jobs"))
+    os.makedirs(jobs_dir, exist_ok=True)
+    progress = await asyncio.to_thread(BulkProgress, os.path.join(jobs_dir, f"{job_id}.ndjson"))
+
+    async def stream():
+        yield json.dumps({"job_id": job_id, "resumed": len(progress.done)}) + "\n"
+        try:
+            async for record in inspect_images(
+                images, run_bulk_batch, progress,
+                batch_size=params.get("bulk_batch_size", 16),
+                max_in_flight=params.get("bulk_max_in_flight", 2),
+                include_detections=include_detections,
+            ):
+                yield json.dumps(record) + "\n"
+        except Exception as e:
+            # The client resumes with the same job_id
+            logger.exception("Bulk job %s failed", job_id)
+            yield json.dumps({"done": False, "job_id": job_id, "error": str(e)}) + "\n"
+        finally:
+            progress.close()
+            if archive is not None:
+                archive.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/results/{result_id}/image")
+async def result_image(result_id: str):
+    """Serve a rendered annotated image as raw bytes."""
+    entry = image_store.get(result_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Result image not found or expired.")
+    image, media_type = entry
+    return Response(
+        content=image,
+        media_type=media_type,
+        headers={"Cache-Control": f"private, max-age={int(image_store.ttl_seconds)}"},
+    )
+
+
+@app.get("/inspections")
+async def inspections(limit: int = 100, line: str = None):
+    """Latest stored inspections, newest first."""
+    if not results_store.enabled:
+        raise HTTPException(status_code=404, detail="Results store is disabled.")
+    return await asyncio.to_thread(results_store.recent, min(limit, 1000), line)
+
+
+@app.get("/rollups")
+async def rollups(granularity: Literal["minute", "hour", "shift"] = "minute", line: str = None, limit: int = 60):
+    """
+    Chart-ready totals (trays, go / no-go, eggs, empty slots) of the latest
+    `limit` minutes, hours or shifts, oldest first; all lines unless `line`.
+    """
+    if not results_store.enabled:
+        raise HTTPException(status_code=404, detail="Results store is disabled.")
+    return await asyncio.to_thread(results_store.rollups, granularity, line, min(limit, 10000))
+
+
+@app.get("/rollups/current-shift")
+async def current_shift(line: str = None):
+    """Totals of the shift running now."""
+    if not results_store.enabled:
+        raise HTTPException(status_code=404, detail="Results store is disabled.")
+    return await asyncio.to_thread(results_store.current_shift, line)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate, size and eviction counters of the result cache."""
+    return result_cache.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text exposition: per-stage latency histograms (read, cache
+    lookup, queue wait, decode, predict, layout, draw, encode, base64,
+    record), end-to-end request latency, batch sizes, queue depths, cache
+    counters and the active model version.
+    """
+    if model_pool is not None:
+        queues = [({"queue": "model_pool"}, model_pool.in_flight)]
+    else:
+        queues = [({"queue": "scheduler"}, scheduler.queue_depth)]
+    if results_store.enabled:
+        queues.append(({"queue": "results_store"}, results_store.queue_depth))
+
+    cache = result_cache.stats()
+    collected = [
+        ("gauge", "egg_tray_queue_depth", "Requests waiting or in flight per queue.", queues),
+        ("counter", "egg_tray_cache_hits_total", "Result cache hits.", [({}, cache["hits"])]),
+        ("counter", "egg_tray_cache_misses_total", "Result cache misses.", [({}, cache["misses"])]),
+        ("counter", "egg_tray_cache_evictions_total", "Result cache evictions.", [({}, cache["evictions"])]),
+        ("gauge", "egg_tray_cache_entries", "Responses held by the result cache.", [({}, cache["entries"])]),
+        ("gauge", "egg_tray_model_info", "Active model weights.", [(
+            {"version": model_manager.version, "path": os.path.relpath(model_manager.model_path, BASE_DIR),
+             "backend": inference_backend}, 1)]),
+        ("gauge", "egg_tray_ready", "1 once the models are warm and /predict/ accepts traffic.",
+         [({}, int(service_state["state"] == "ready"))]),
+    ]
+    if results_store.enabled:
+        store = results_store.stats()
+        collected.append(("counter", "egg_tray_results_dropped_total",
+                          "Inspections dropped because the results queue was full.", [({}, store["dropped"])]))
+
+    body = render([stage_seconds, request_seconds, batch_size, requests_total], collected)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the API process is up and its event loop is responsive."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: models are loaded and warmed up, /predict/ accepts traffic.
+    With shared-memory workers, also why any of them is down (a crash or
+    a model that failed to load); 503 while none is taking jobs.
+    """
+    body = {
+        "status": service_state["state"],
+        "error": service_state["error"],
+        "model_path": model_manager.model_path,
+        "worker_pool_kind": worker_pool_kind,
+    }
+    ready = service_state["state"] == "ready"
+    if model_pool is not None:
+        body["ready_workers"] = model_pool.ready_workers
+        body["worker_errors"] = {str(index): error for index, error in sorted(model_pool.worker_errors.items())}
+        ready = ready and model_pool.ready_workers > 0
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+def check_admin_token(token):
+    expected = params.get("admin_token")
+    if expected and token != expected:
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+@app.get("/admin/model")
+async def model_status(x_admin_token: str = Header(None)):
+    """Active model version and the state of the last reload."""
+    check_admin_token(x_admin_token)
+    return {
+        "model_path": model_manager.model_path,
+        "version": model_manager.version,
+        "reload": reload_state,
+    }
+
+
+@app.post("/admin/model/reload", status_code=202)
+async def reload_model(source: str = Body(..., embed=True), x_admin_token: str = Header(None)):
+    """
+    Start a zero-downtime model swap. `source` is a weights path (relative
+    to the project root) or an MLflow artifact URI such as
+    "runs:/<run_id>/weights/best.pt". Poll GET /admin/model for progress.
+    """
+    check_admin_token(x_admin_token)
+    if service_state["state"] != "ready":
+        raise HTTPException(status_code=503, detail="Initial model warm-up has not finished.")
+    if reload_state["state"] == "loading":
+        raise HTTPException(status_code=409, detail="A model reload is already in progress.")
+
+    reload_state.update(state="loading", source=source, error=None)
+    task = asyncio.create_task(swap_model(source))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return {"status": "accepted", "source": source}
@@ -0,0 +1,187 @@
+# backend/metrics.py
+
+import threading
+import time
+from bisect import bisect_left
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Seconds, from a fast decode to a slow 12MP CPU predict
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class _Timer:
+    """Context manager observing its wall time (perf_counter) on exit."""
+
+    __slots__ = ("histogram", "key", "start")
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe_key(self.key, time.perf_counter() - self.start)
+        return False
+
+
+# --------------------------------------------------
+# Histogram / Counter (Prometheus text format)
+# --------------------------------------------------
+class Histogram:
+    """
+    Fixed-bucket histogram per label set, safe to observe from any thread.
+
+    An observation is one bisect and a few additions under a lock (about
+    two microseconds), so stages can stay timed in production. `drain` hands
+    the observations collected so far to another process's `merge`,
+    which is how worker processes report their stage timings.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(float(b) for b in buckets)
+        self._series = {}  # label values → [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        self.observe_key(labelvalues, value)
+
+    def observe_key(self, key: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labelvalues) -> _Timer:
+        """`with histogram.time("decode"):` observes the block's duration."""
+        return _Timer(self, labelvalues)
+
+    def drain(self) -> dict:
+        """Observations since the last drain, resetting them."""
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series: dict):
+        with self._lock:
+            for key, values in series.items():
+                mine = self._series.get(key)
+                if mine is None:
+                    self._series[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        mine[i] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {values[-1]!r}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+def render(metrics, collected=()) -> str:
+    """
+    Prometheus text exposition (format 0.0.4) of Histogram / Counter
+    objects plus `collected` (kind, name, documentation, [(labels dict,
+    value)]) tuples read at scrape time, e.g. queue depths and cache
+    counters that already exist elsewhere.
+    """
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    for kind, name, documentation, samples in collected:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------------------------------
+# Inference Metrics
+# --------------------------------------------------
+# Every step of one tray: read, cache, queue_wait, decode, predict, layout, draw, encode, base64, record
+stage_seconds = Histogram("egg_tray_stage_seconds", "Time spent in each inference stage.", ("stage",))
+request_seconds = Histogram("egg_tray_request_seconds", "End-to-end /predict/ handler time.", ("output", "cached"))
+batch_size = Histogram("egg_tray_batch_size", "Images per batched model call.", buckets=BATCH_SIZE_BUCKETS)
+requests_total = Counter("egg_tray_requests_total", "/predict/ requests by outcome.", ("outcome",))
+
+
+def timed(stage: str) -> _Timer:
+    """`with timed("decode"): ...` records the block under egg_tray_stage_seconds."""
+    return _Timer(stage_seconds, (stage,))
+
+
+def drain_worker_metrics() -> dict:
+    """Stage and batch observations of this (worker) process since the last call."""
+    return {"stage_seconds": stage_seconds.drain(), "batch_size": batch_size.drain()}
+
+
+def merge_worker_metrics(drained: dict):
+    """Add a worker process's drained observations to this process."""
+    stage_seconds.merge(drained["stage_seconds"])
+    batch_size.merge(drained["batch_size"])
+
+
+def with_worker_metrics(fn, *args):
+    """Run `fn(*args)` in a pool process and return (result, its drained metrics)."""
+    return fn(*args), drain_worker_metrics()
@@ -0,0 +1,164 @@
+# backend/model_manager.py
+
+import glob
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from ultralytics import YOLO
+
+
+MLFLOW_URI_PREFIXES = ("runs:/", "models:/", "mlflow-artifacts:/")
+
+
+def model_fingerprint(path: str) -> str:
+    """Identify a weights file by name, size and modification time."""
+    stat = os.stat(path)
+    return f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def resolve_weights(source: str, base_dir: str) -> str:
+    """
+    Turn a weights source into a local file path.
+
+    Accepts a path (relative paths are resolved against `base_dir`) or an
+    MLflow artifact URI such as "runs:/<run_id>/weights/best.pt", which is
+    downloaded first. When the source is a directory, the single .pt file
+    inside it (preferring best.pt) is used.
+    """
+    if source.startswith(MLFLOW_URI_PREFIXES):
+        import mlflow
+        path = mlflow.artifacts.download_artifacts(artifact_uri=source)
+    else:
+        path = source if os.path.isabs(source) else os.path.join(base_dir, source)
+
+    if os.path.isdir(path):
+        candidates = sorted(glob.glob(os.path.join(path, "**", "*.pt"), recursive=True))
+        best = [c for c in candidates if os.path.basename(c) == "best.pt"]
+        if best:
+            path = best[0]
+        elif len(candidates) == 1:
+            path = candidates[0]
+        else:
+            raise FileNotFoundError(f"Expected one .pt weights file in {path}, found {len(candidates)}.")
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Model weights not found: {path}")
+    return path
+
+
+class _Generation:
+    """One loaded set of model instances for a single weights file."""
+
+    def __init__(self, model_path, instances):
+        self.model_path = model_path
+        self.version = model_fingerprint(model_path)
+        self.instances = queue.Queue()
+        for instance in instances:
+            self.instances.put(instance)
+
+
+# --------------------------------------------------
+# Model Lifecycle Manager
+# --------------------------------------------------
+class ModelManager:
+    """
+    Owns the YOLO model instances used for inference in this process.
+
+    Nothing is loaded at import time. `load` reads the weights into
+    `num_instances` independent YOLO objects (ultralytics predictors are
+    not thread-safe, so each concurrent worker thread borrows its own via
+    `acquire`) and runs `warmup_runs` predictions on a dummy frame so the
+    first real request does not pay for graph and allocator set-up.
+
+    `reload` builds and warms a complete new generation of instances in
+    the caller's thread while the current one keeps serving, then swaps it
+    in atomically. Requests that already borrowed an old instance finish
+    on it; the old generation is dropped once they return it.
+
+    `state` moves through "idle" → "loading" → "warming" → "ready"
+    (or "failed", with the error kept in `error`).
+    """
+
+    def __init__(self, model_path: str, num_instances: int = 1, warmup_runs: int = 1, warmup_imgsz: int = 640):
+        self.model_path = model_path
+        self.num_instances = max(num_instances, 1)
+        self.warmup_runs = warmup_runs
+        self.warmup_imgsz = warmup_imgsz
+        self.state = "idle"
+        self.error = None
+        self._generation = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def version(self) -> str:
+        generation = self._generation
+        if generation is not None:
+            return generation.version
+        return model_fingerprint(self.model_path)
+
+    def load(self):
+        """Load and warm every model instance. Safe to call more than once."""
+        with self._reload_lock:
+            if self.ready:
+                return
+            try:
+                self._generation = self._build(self.model_path)
+                self.state = "ready"
+            except Exception as e:
+                self.state = "failed"
+                self.error = e
+                raise
+
+    def reload(self, model_path: str):
+        """
+        Load and warm `model_path`, then atomically swap it in.
+        On failure the current model keeps serving and the error is raised.
+        """
+        with self._reload_lock:
+            generation = self._build(model_path, update_state=not self.ready)
+            with self._lock:
+                self._generation = generation
+                self.model_path = model_path
+            self.state = "ready"
+            self.error = None
+
+    def ensure_loaded(self):
+        """Load on first use (e.g. in worker processes or standalone scripts)."""
+        if not self.ready:
+            self.load()
+
+    @contextmanager
+    def acquire(self):
+        """Borrow one model instance for the duration of a predict call."""
+        self.ensure_loaded()
+        with self._lock:
+            generation = self._generation
+        instance = generation.instances.get()
+        try:
+            yield instance
+        finally:
+            # Returned to the generation it came from, even after a swap
+            generation.instances.put(instance)
+
+    def _build(self, model_path, update_state=True):
+        if update_state:
+            self.state = "loading"
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model weights not found: {model_path}")
+        instances = [YOLO(model_path, task="detect") for _ in range(self.num_instances)]
+
+        if update_state:
+            self.state = "warming"
+        dummy = np.zeros((self.warmup_imgsz, self.warmup_imgsz, 3), dtype=np.uint8)
+        for instance in instances:
+            for _ in range(self.warmup_runs):
+                instance.predict(source=dummy, verbose=False)
+        return _Generation(model_path, instances)
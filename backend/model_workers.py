@@ -0,0 +1,507 @@
+# backend/model_workers.py
+
+import asyncio
+import base64
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from backend.metrics import drain_worker_metrics, merge_worker_metrics, timed
+
+
+class PoolBusyError(Exception):
+    """Raised by `infer` when every shared-memory slot is in use."""
+
+
+class ImageTooLargeError(Exception):
+    """Raised by `infer` when an upload does not fit in one shared-memory slot."""
+
+
+# --------------------------------------------------
+# Worker Process
+# --------------------------------------------------
+def _worker_main(index, shm_name, slot_bytes, job_queue, control_queue, result_queue, cpu, settings):
+    """
+    Entry point of one model worker process.
+
+    Upload bytes are read straight from the worker's shared-memory slot,
+    decoded, run through YOLO (several queued jobs are batched together)
+    and the encoded annotated image is written back into the same slot.
+    Only small metrics dicts travel through the result queue; metrics-only
+    jobs skip drawing and encoding altogether.
+
+    Between batches the worker checks its own control queue, where the
+    parent sends ("reload", weights_path) for rolling model swaps, and
+    reports the stage timings it collected. A model that cannot be loaded
+    is reported as ("failed", index, error) before the worker exits.
+    """
+    # Pin to one core and keep libraries from spawning their own thread pools
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+    import cv2
+    import torch
+    torch.set_num_threads(settings["threads"])
+    cv2.setNumThreads(1)
+
+    from backend import yolo_inference
+
+    # Spawned workers share the parent's resource tracker, which unlinks
+    # the block once when the parent calls `unlink` on shutdown
+    shm = SharedMemory(name=shm_name)
+    ring = np.ndarray((shm.size,), dtype=np.uint8, buffer=shm.buf)
+
+    # Pre-warm: first predict calls pay for graph and allocator initialisation
+    model_manager = yolo_inference.model_manager
+    model_manager.model_path = settings["model_path"]
+    model_manager.warmup_runs = settings["warmup_runs"]
+    try:
+        model_manager.load()
+    except Exception as e:
+        result_queue.put(("failed", index, f"{type(e).__name__}: {e}"))
+        del ring
+        shm.close()
+        return
+    result_queue.put(("ready", index))
+
+    stopping = False
+    while not stopping:
+        # Control messages are handled between batches, never mid-batch
+        try:
+            command, argument = control_queue.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            if command == "reload":
+                try:
+                    model_manager.reload(argument)
+                    result_queue.put(("reloaded", index, None))
+                except Exception as e:
+                    result_queue.put(("reloaded", index, str(e)))
+
+        try:
+            job = job_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if job is None:
+            break
+        jobs = [job]
+
+        # Batch whatever else is already waiting
+        while len(jobs) < settings["max_batch_size"]:
+            try:
+                job = job_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            jobs.append(job)
+
+        result_queue.put(("taken", index, [job[0] for job in jobs]))
+
+        decoded = []
+        for job_id, slot, size, output in jobs:
+            offset = slot * slot_bytes
+            try:
+                frame, scale = yolo_inference.decode_tray_image(ring[offset:offset + size])
+            except ValueError as e:
+                result_queue.put(("done", index, job_id, ("error", e)))
+                continue
+            decoded.append((job_id, slot, frame, output, scale))
+
+        if not decoded:
+            continue
+
+        try:
+            results = yolo_inference.run_detection([job[2] for job in decoded])
+        except Exception as e:
+            for job_id, *_ in decoded:
+                result_queue.put(("done", index, job_id, ("error", e)))
+            continue
+
+        for (job_id, slot, frame, output, scale), result in zip(decoded, results):
+            try:
+                if output == "metrics":
+                    # No image to hand back: the JSON summary is small enough to pickle
+                    result_queue.put(("done", index, job_id, ("ok", yolo_inference.summarize_tray(result, scale), None, None)))
+                    continue
+                metrics, annotated = yolo_inference.analyse_tray(frame, result, scale)
+                image, media_type = yolo_inference.encode_image(annotated)
+                metrics["media_type"] = media_type
+                if len(image) <= slot_bytes:
+                    offset = slot * slot_bytes
+                    ring[offset:offset + len(image)] = np.frombuffer(image, dtype=np.uint8)
+                    payload = ("ok", metrics, len(image), None)
+                else:
+                    # Output larger than the slot: fall back to pickling it
+                    payload = ("ok", metrics, -1, image)
+            except Exception as e:
+                payload = ("error", e)
+            result_queue.put(("done", index, job_id, payload))
+
+        result_queue.put(("metrics", index, drain_worker_metrics()))
+
+    del ring
+    shm.close()
+
+
+# --------------------------------------------------
+# Multi-process Model Worker Pool
+# --------------------------------------------------
+class ModelProcessPool:
+    """
+    Pool of pre-warmed model worker processes fed through shared memory.
+
+    One SharedMemory block is split into fixed-size slots (a ring of
+    `num_workers * slots_per_worker` entries). For each request the handler
+    copies the upload into a free slot and sends only (job_id, slot, size)
+    to the job queue of the least busy worker, so image data is never
+    pickled in either direction. Free slots double as admission control:
+    when none is left `infer` raises PoolBusyError.
+
+    Workers are started with the "spawn" method, optionally pinned to one
+    core each, and limited to `threads_per_worker` torch threads so
+    throughput scales with the number of processes rather than threads.
+    Crashed workers are detected within `check_interval` seconds, even
+    under full load. Every job sent to a dead worker is failed and its slot
+    freed, whether or not the worker had picked it up yet. The worker is
+    restarted with an exponential backoff and left down after
+    `max_restarts` consecutive crashes or failed model loads; the reason is
+    kept in `worker_errors`. `reload` swaps the weights one worker at a
+    time, so the others keep serving while each one loads and warms the
+    new model.
+
+    Stage timings measured in the workers are merged into this process's
+    metrics after every batch; `on_dispatch(waits)` gets the seconds each
+    job of a batch waited before a worker took it.
+    """
+
+    def __init__(self, model_path: str, num_workers: int = None, slots_per_worker: int = 4, slot_mb: float = 8,
+                 pin_workers: bool = True, threads_per_worker: int = 1, warmup_runs: int = 1,
+                 max_batch_size: int = 8, job_timeout: float = 30.0, ready_timeout: float = 300.0,
+                 on_dispatch=None, check_interval: float = 0.5, max_restarts: int = 5):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.num_slots = self.num_workers * max(slots_per_worker, 1)
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.pin_workers = pin_workers
+        self.job_timeout = job_timeout
+        self.check_interval = check_interval
+        self.max_restarts = max_restarts
+        self.ready_timeout = ready_timeout
+        self.on_dispatch = on_dispatch
+        self.settings = {
+            "model_path": model_path,
+            "threads": threads_per_worker,
+            "warmup_runs": warmup_runs,
+            "max_batch_size": max_batch_size,
+        }
+        self._ctx = multiprocessing.get_context("spawn")
+        self._shm = None
+        self._ring = None
+        self._processes = []
+        self._job_queues = []
+        self._control_queues = []
+        self._result_queue = None
+        self._reloads = {}
+        self._free_slots = None
+        self._loop = None
+        self._jobs = {}
+        self._assigned = {}
+        self._submitted = {}
+        self._ready = set()
+        self._failures = {}
+        self._respawn_at = {}
+        self.worker_errors = {}
+        self._lock = threading.Lock()
+        self._next_job_id = 0
+        self._reader = None
+        self._stopping = threading.Event()
+
+    @property
+    def in_flight(self) -> int:
+        """Number of jobs submitted and not yet answered."""
+        return self.num_slots - self._free_slots.qsize() if self._free_slots is not None else 0
+
+    @property
+    def ready_workers(self) -> int:
+        """Number of workers with a warm model, taking jobs."""
+        return len(self._ready)
+
+    async def start(self):
+        """Allocate shared memory, spawn the workers and wait until all are warm."""
+        self._loop = asyncio.get_running_loop()
+        self._shm = SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        self._ring = np.ndarray((self._shm.size,), dtype=np.uint8, buffer=self._shm.buf)
+        self._job_queues = [None] * self.num_workers
+        self._control_queues = [None] * self.num_workers
+        self._result_queue = self._ctx.Queue()
+        self._free_slots = asyncio.Queue()
+        for slot in range(self.num_slots):
+            self._free_slots.put_nowait(slot)
+
+        self._processes = [None] * self.num_workers
+        self._failures = {index: 0 for index in range(self.num_workers)}
+        for index in range(self.num_workers):
+            self._spawn(index)
+        await asyncio.to_thread(self._wait_ready)
+
+        self._stopping.clear()
+        self._reader = threading.Thread(target=self._read_results, name="model-pool-results", daemon=True)
+        self._reader.start()
+
+    async def stop(self):
+        """Stop the workers and release shared memory."""
+        if self._shm is None:
+            return
+        self._stopping.set()
+        processes = [process for process in self._processes if process is not None]
+        for index, process in enumerate(self._processes):
+            if process is not None:
+                self._job_queues[index].put(None)
+        for process in processes:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+        if self._reader is not None:
+            await asyncio.to_thread(self._reader.join, 5)
+
+        for future, _, _ in self._jobs.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Model worker pool stopped."))
+        self._jobs.clear()
+        self._submitted.clear()
+
+        self._ring = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    async def infer(self, image_bytes: bytes, output: str = "base64", wait: bool = False):
+        """
+        Run one image through a worker and return the JSON result.
+        `output` has the same meaning as in yolo_inference.build_response.
+        With `wait`, the call waits for a free slot instead of raising
+        PoolBusyError.
+        """
+        if len(image_bytes) > self.slot_bytes:
+            raise ImageTooLargeError(f"Image is {len(image_bytes)} bytes; the limit is {self.slot_bytes} bytes "
+                                     f"(shm_slot_mb).")
+        if wait:
+            slot = await self._free_slots.get()
+        else:
+            try:
+                slot = self._free_slots.get_nowait()
+            except asyncio.QueueEmpty:
+                raise PoolBusyError("All model workers are busy.") from None
+
+        offset = slot * self.slot_bytes
+        self._ring[offset:offset + len(image_bytes)] = np.frombuffer(image_bytes, dtype=np.uint8)
+
+        future = self._loop.create_future()
+        with self._lock:
+            # Prefer warm workers, then the one with the fewest jobs outstanding
+            running = [index for index, process in enumerate(self._processes) if process is not None]
+            if not running:
+                self._free_slots.put_nowait(slot)
+                raise PoolBusyError("No model worker is running.")
+            index = min(running, key=lambda i: (i not in self._ready, len(self._assigned[i])))
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._jobs[job_id] = (future, slot, output)
+            self._assigned[index].add(job_id)
+            self._submitted[job_id] = time.perf_counter()
+            job_queue = self._job_queues[index]
+        job_queue.put((job_id, slot, len(image_bytes), output))
+
+        # The slot is returned by `_resolve` once the worker answers, even
+        # if this request has already given up waiting
+        return await asyncio.wait_for(asyncio.shield(future), self.job_timeout)
+
+    async def reload(self, model_path: str):
+        """
+        Rolling model swap: each worker in turn loads and warms `model_path`
+        between batches while the remaining workers keep taking jobs.
+        """
+        for index in range(self.num_workers):
+            done = threading.Event()
+            self._reloads[index] = [done, None]
+            self._control_queues[index].put(("reload", model_path))
+            finished = await asyncio.to_thread(done.wait, self.ready_timeout)
+            error = self._reloads.pop(index)[1]
+            if not finished or error:
+                raise RuntimeError(f"Model worker {index} failed to reload: {error or 'timed out'}")
+
+        # Workers restarted from now on load the new weights too
+        self.settings["model_path"] = model_path
+
+    # ------------------------------
+    # Internals
+    # ------------------------------
+    def _spawn(self, index):
+        cpu = None
+        if self.pin_workers and hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+            cpu = cpus[index % len(cpus)]
+        # Fresh queues: whatever was left in a dead worker's queues has been failed already
+        job_queue = self._ctx.Queue()
+        self._control_queues[index] = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._shm.name, self.slot_bytes, job_queue,
+                  self._control_queues[index], self._result_queue, cpu, self.settings),
+            name=f"model-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        with self._lock:
+            self._job_queues[index] = job_queue
+            self._assigned[index] = set()
+            self._processes[index] = process
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.ready_timeout
+        while len(self._ready) < self.num_workers:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Model workers did not become ready in time.")
+            try:
+                message = self._result_queue.get(timeout=self.check_interval)
+            except queue.Empty:
+                message = None
+            if message is None:
+                for index, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        raise RuntimeError(f"Model worker {index} exited with code {process.exitcode} while loading.")
+            elif message[0] == "failed":
+                raise RuntimeError(f"Model worker {message[1]} failed to load the model: {message[2]}")
+            elif message[0] == "ready":
+                self._ready.add(message[1])
+
+    def _read_results(self):
+        # Liveness is checked on a fixed interval: under steady load the queue is never idle
+        next_check = time.monotonic() + self.check_interval
+        while not self._stopping.is_set():
+            try:
+                message = self._result_queue.get(timeout=max(next_check - time.monotonic(), 0))
+            except queue.Empty:
+                message = None
+            if message is not None:
+                self._handle(message)
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + self.check_interval
+
+    def _handle(self, message):
+        kind = message[0]
+        if kind == "taken":
+            _, index, job_ids = message
+            now = time.perf_counter()
+            with self._lock:
+                waits = [now - self._submitted.pop(job_id) for job_id in job_ids if job_id in self._submitted]
+            if self.on_dispatch is not None:
+                self.on_dispatch(waits)
+        elif kind == "done":
+            _, index, job_id, payload = message
+            with self._lock:
+                self._assigned[index].discard(job_id)
+            self._complete(job_id, payload)
+        elif kind == "ready":
+            _, index = message
+            with self._lock:
+                self._ready.add(index)
+            self._failures[index] = 0
+            self.worker_errors.pop(index, None)
+        elif kind == "failed":
+            _, index, error = message
+            self.worker_errors[index] = f"Model failed to load: {error}"
+        elif kind == "metrics":
+            merge_worker_metrics(message[2])
+        elif kind == "reloaded":
+            _, index, error = message
+            pending = self._reloads.get(index)
+            if pending is not None:
+                pending[1] = error
+                pending[0].set()
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if self._stopping.is_set():
+                return
+            if process is None:
+                if index in self._respawn_at and now >= self._respawn_at[index]:
+                    del self._respawn_at[index]
+                    self._spawn(index)
+                continue
+            if process.is_alive():
+                continue
+            # Results the worker sent before it died still count: handle them first
+            while True:
+                try:
+                    self._handle(self._result_queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._worker_died(index, process.exitcode)
+
+    def _worker_died(self, index, exitcode):
+        """Fail every job sent to a dead worker and schedule its restart."""
+        with self._lock:
+            self._processes[index] = None
+            self._ready.discard(index)
+            lost = list(self._assigned[index])
+            self._assigned[index].clear()
+        for job_id in lost:
+            self._complete(job_id, ("error", RuntimeError("Model worker crashed.")))
+        pending = self._reloads.get(index)
+        if pending is not None:
+            pending[1] = "Model worker crashed."
+            pending[0].set()
+
+        # A load failure has already reported its own reason
+        self.worker_errors.setdefault(index, f"Model worker exited with code {exitcode}.")
+        self._failures[index] += 1
+        if self._failures[index] > self.max_restarts:
+            self.worker_errors[index] += f" (not restarted after {self.max_restarts} attempts)"
+            return
+        # 1s, 2s, 4s, ... between attempts, at most one minute
+        self._respawn_at[index] = time.monotonic() + min(2 ** (self._failures[index] - 1), 60)
+
+    def _complete(self, job_id, payload):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            self._submitted.pop(job_id, None)
+        if job is not None:
+            self._loop.call_soon_threadsafe(self._resolve, *job, payload)
+
+    def _resolve(self, future, slot, output, payload):
+        """Runs on the event loop: copy the result out and free the slot."""
+        if payload[0] == "ok":
+            _, metrics, size, overflow = payload
+            if size is None:
+                image = None
+            elif size >= 0:
+                offset = slot * self.slot_bytes
+                image = self._ring[offset:offset + size].tobytes()
+            else:
+                image = overflow
+            self._free_slots.put_nowait(slot)
+            if future.done():
+                return
+            if image is None:
+                future.set_result(metrics)
+            elif output == "bytes":
+                future.set_result({**metrics, "annotated_image": image})
+            else:
+                metrics.pop("media_type", None)
+                with timed("base64"):
+                    encoded_image = base64.b64encode(image).decode("utf-8")
+                future.set_result({**metrics, "annotated_image_base64": encoded_image})
+        else:
+            self._free_slots.put_nowait(slot)
+            if not future.done():
+                future.set_exception(payload[1])
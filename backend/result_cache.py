@@ -0,0 +1,115 @@
+# backend/result_cache.py
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def _result_size(result: dict) -> int:
+    """Approximate memory held by one cached response (its image payload)."""
+    size = 0
+    for value in result.values():
+        if isinstance(value, (bytes, str)):
+            size += len(value)
+    return size
+
+
+# --------------------------------------------------
+# Content-hash Result Cache
+# --------------------------------------------------
+class ResultCache:
+    """
+    LRU cache of /predict/ responses keyed by image content.
+
+    The key is a hash of the uploaded bytes plus a fingerprint of the active
+    model and inference parameters (see `make_key`), so re-submitted trays
+    are answered without running inference, and a new model or changed
+    thresholds never serve stale results.
+
+    Entries are evicted least-recently-used once `max_entries` or
+    `max_bytes` is exceeded, and expire after `ttl_seconds`. Used from the
+    event loop only, so no locking is needed.
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str, params: dict, output: str) -> str:
+        """Hash of image content + model + inference parameters + response mode."""
+        digest = hashlib.blake2b(image_bytes, digest_size=16)
+        digest.update(model_version.encode("utf-8"))
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(output.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """Return a copy of the cached result, or None on a miss."""
+        entry = self._items.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        created, size, result = entry
+        if time.monotonic() - created > self.ttl_seconds:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return dict(result)
+
+    def put(self, key: str, result: dict):
+        """Store a result, evicting least-recently-used entries if needed."""
+        if not self.enabled:
+            return
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._items:
+            self._remove(key)
+
+        self._items[key] = (time.monotonic(), size, dict(result))
+        self._bytes += size
+        while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._items))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._items.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
@@ -0,0 +1,398 @@
+# backend/results_store.py
+
+import datetime
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inspections (
+    id              INTEGER PRIMARY KEY,
+    tray_id         TEXT    NOT NULL,
+    timestamp       REAL    NOT NULL,
+    line            TEXT    NOT NULL,
+    shift_date      TEXT    NOT NULL,
+    shift           TEXT    NOT NULL,
+    tray_status     TEXT    NOT NULL,
+    num_eggs        INTEGER NOT NULL,
+    num_empty_slots INTEGER NOT NULL,
+    model_version   TEXT,
+    image_hash      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_inspections_timestamp ON inspections (timestamp);
+CREATE INDEX IF NOT EXISTS idx_inspections_line ON inspections (line, timestamp);
+CREATE INDEX IF NOT EXISTS idx_inspections_shift ON inspections (shift_date, shift, line);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    granularity  TEXT    NOT NULL,
+    line         TEXT    NOT NULL,
+    bucket_start REAL    NOT NULL,
+    bucket       TEXT    NOT NULL,
+    trays        INTEGER NOT NULL,
+    go_trays     INTEGER NOT NULL,
+    no_go_trays  INTEGER NOT NULL,
+    eggs         INTEGER NOT NULL,
+    empty_slots  INTEGER NOT NULL,
+    PRIMARY KEY (granularity, line, bucket_start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollups_bucket ON rollups (granularity, bucket_start);
+"""
+
+GRANULARITIES = ("minute", "hour", "shift")
+TOTALS = ("trays", "go_trays", "no_go_trays", "eggs", "empty_slots")
+
+UPSERT_ROLLUP = f"""
+INSERT INTO rollups (granularity, line, bucket_start, bucket, {', '.join(TOTALS)})
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (granularity, line, bucket_start) DO UPDATE SET
+    {', '.join(f"{name} = {name} + excluded.{name}" for name in TOTALS)}
+"""
+
+COLUMNS = ("id", "tray_id", "timestamp", "line", "shift_date", "shift", "tray_status",
+           "num_eggs", "num_empty_slots", "model_version", "image_hash")
+
+# Stops the writer thread
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def shift_of(timestamp: float, shift_starts: dict):
+    """
+    (shift_date, shift_name) for a Unix timestamp, given shift start times
+    such as {"Day Shift": "06:00", "Night Shift": "18:00"}. A shift that
+    runs past midnight belongs to the date it started on.
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    starts = sorted(
+        (datetime.time.fromisoformat(start), name) for name, start in shift_starts.items()
+    )
+    minutes = moment.hour * 60 + moment.minute
+    current = None
+    for start, name in starts:
+        if start.hour * 60 + start.minute <= minutes:
+            current = name
+    if current is None:
+        # Before the first shift of the day: still the last shift of yesterday
+        return (moment.date() - datetime.timedelta(days=1)).isoformat(), starts[-1][1]
+    return moment.date().isoformat(), current
+
+
+def shift_start(shift_date: str, shift: str, shift_starts: dict) -> float:
+    """Unix timestamp at which `shift` on `shift_date` began."""
+    start = datetime.time.fromisoformat(shift_starts[shift])
+    return datetime.datetime.combine(datetime.date.fromisoformat(shift_date), start).timestamp()
+
+
+def buckets_of(timestamp: float, shift_date: str, shift: str, shift_starts: dict):
+    """(granularity, bucket_start, label) of the minute, hour and shift a timestamp falls in."""
+    moment = datetime.datetime.fromtimestamp(timestamp)
+    minute = moment.replace(second=0, microsecond=0)
+    hour = minute.replace(minute=0)
+    return (
+        ("minute", minute.timestamp(), minute.strftime("%Y-%m-%d %H:%M")),
+        ("hour", hour.timestamp(), hour.strftime("%Y-%m-%d %H:00")),
+        ("shift", shift_start(shift_date, shift, shift_starts), f"{shift_date} {shift}"),
+    )
+
+
+def rollup_rows(rows, shift_starts: dict) -> dict:
+    """
+    Sum inspection rows into {(granularity, line, bucket_start): [label, trays,
+    go, no_go, eggs, empty_slots]}, one entry per minute, hour and shift.
+    """
+    totals = {}
+    for row in rows:
+        timestamp, line, shift_date, shift, tray_status, eggs, empty_slots = row[2:9]
+        go = tray_status.lower() == "ok"
+        for granularity, start, label in buckets_of(timestamp, shift_date, shift, shift_starts):
+            entry = totals.get((granularity, line, start))
+            if entry is None:
+                entry = totals[(granularity, line, start)] = [label, 0, 0, 0, 0, 0]
+            entry[1] += 1
+            entry[2] += go
+            entry[3] += not go
+            entry[4] += eggs
+            entry[5] += empty_slots
+    return totals
+
+
+# --------------------------------------------------
+# Write-behind Inspection Store
+# --------------------------------------------------
+class ResultsStore:
+    """
+    Persists every tray inspection to SQLite without the request path ever
+    touching the disk.
+
+    `record` assigns the inspection ID, puts the row on an in-memory queue
+    and returns immediately; a single writer thread drains the queue and
+    inserts up to `batch_size` rows per transaction, at least every
+    `flush_seconds`. When the queue is full (disk stalled) rows are dropped
+    and counted rather than blocking inference.
+
+    Per-minute, per-hour and per-shift totals (trays, go / no-go, eggs,
+    empty slots) per line are kept in the `rollups` table, updated in the
+    same transaction as each batch, so dashboards read a handful of rows
+    instead of scanning inspections. Rows still waiting for the writer are
+    held as in-memory deltas and added to query results, so a tray counts
+    the moment its response is sent.
+
+    Reads (`recent`, `rollups`) use their own connection, so they never
+    wait on the writer for long thanks to WAL mode.
+    """
+
+    def __init__(self, path: str, shift_starts: dict = None, batch_size: int = 256,
+                 flush_seconds: float = 1.0, max_queue_size: int = 10000):
+        self.path = path
+        self.shift_starts = shift_starts or {"Day Shift": "06:00", "Night Shift": "18:00"}
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._ids = None
+        self._thread = None
+        # Rollup deltas of queued rows; the commit lock makes "written" and "pending" switch atomically
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """Create the schema and start the writer thread."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        with connection:
+            connection.executescript(SCHEMA)
+        last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM inspections").fetchone()[0]
+        if last_id and connection.execute("SELECT COUNT(*) FROM rollups").fetchone()[0] == 0:
+            self._backfill_rollups(connection)
+        connection.close()
+
+        # IDs are handed out in memory so responses can carry them before the row is written
+        self._ids = itertools.count(last_id + 1)
+        self._thread = threading.Thread(target=self._write_loop, name="results-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush everything still queued and stop the writer."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def record(self, result: dict, line: str, tray_id: str = None, model_version: str = None,
+               image_hash: str = None, timestamp: float = None) -> dict:
+        """
+        Queue one inspection. Returns {"inspection_id", "tray_id"} at once;
+        the tray ID defaults to the inspection ID when the caller has none.
+        """
+        timestamp = timestamp or time.time()
+        inspection_id = next(self._ids)
+        tray_id = tray_id or str(inspection_id)
+        shift_date, shift = shift_of(timestamp, self.shift_starts)
+        row = (inspection_id, tray_id, timestamp, line, shift_date, shift, result["tray_status"],
+               result["num_eggs"], result["num_empty_slots"], model_version, image_hash)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            with self._pending_lock:
+                _merge(self._pending, rollup_rows([row], self.shift_starts))
+        return {"inspection_id": inspection_id, "tray_id": tray_id}
+
+    def recent(self, limit: int = 100, line: str = None) -> list:
+        """Latest inspections, newest first (blocking; call from a thread)."""
+        query = f"SELECT {', '.join(COLUMNS)} FROM inspections"
+        args = []
+        if line:
+            query += " WHERE line = ?"
+            args.append(line)
+        query += " ORDER BY timestamp DESC LIMIT ?"
+        args.append(limit)
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, args).fetchall()
+        finally:
+            connection.close()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def rollups(self, granularity: str = "minute", line: str = None, limit: int = 60) -> dict:
+        """
+        The latest `limit` buckets of one granularity, oldest first, as
+        chart-ready columns: {"bucket": [...], "trays": [...], ...}. Without
+        `line`, all lines are summed. Blocking; call from a thread.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}")
+        query = f"SELECT bucket_start, bucket, {', '.join(f'SUM({name})' for name in TOTALS)} FROM rollups" \
+                " WHERE granularity = ?"
+        args = [granularity]
+        if line:
+            query += " AND line = ?"
+            args.append(line)
+        query += " GROUP BY bucket_start ORDER BY bucket_start DESC LIMIT ?"
+        args.append(limit)
+
+        connection = self._connect()
+        try:
+            with self._commit_lock:
+                rows = connection.execute(query, args).fetchall()
+                with self._pending_lock:
+                    pending = [(start, entry) for (g, l, start), entry in self._pending.items()
+                               if g == granularity and (not line or l == line)]
+        finally:
+            connection.close()
+
+        buckets = {start: [label, *totals] for start, label, *totals in rows}
+        for start, entry in pending:
+            if start in buckets:
+                buckets[start][1:] = [a + b for a, b in zip(buckets[start][1:], entry[1:])]
+            else:
+                buckets[start] = list(entry)
+        starts = sorted(buckets)[-limit:]
+
+        series = {"granularity": granularity, "line": line, "bucket_start": starts,
+                  "bucket": [buckets[start][0] for start in starts]}
+        for i, name in enumerate(TOTALS, start=1):
+            series[name] = [buckets[start][i] for start in starts]
+        return series
+
+    def current_shift(self, line: str = None) -> dict:
+        """Totals of the shift running now (zeros before its first tray)."""
+        shift_date, shift = shift_of(time.time(), self.shift_starts)
+        start = shift_start(shift_date, shift, self.shift_starts)
+        series = self.rollups("shift", line, limit=1)
+        summary = {"shift_date": shift_date, "shift": shift, "shift_start": start, "line": line}
+        current = bool(series["bucket_start"]) and series["bucket_start"][0] == start
+        for name in TOTALS:
+            summary[name] = series[name][0] if current else 0
+        return summary
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "queued": self.queue_depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+    # --- writer thread ---
+    def _write_loop(self):
+        connection = self._connect()
+        stopping = False
+        try:
+            while not stopping:
+                rows, stopping = self._collect()
+                if rows:
+                    self._insert(connection, rows)
+        finally:
+            connection.close()
+
+    def _collect(self):
+        """Up to batch_size rows, waiting at most flush_seconds after the first."""
+        rows = []
+        try:
+            first = self._queue.get(timeout=self.flush_seconds)
+        except queue.Empty:
+            return rows, False
+        if first is _STOP:
+            return rows, True
+        rows.append(first)
+
+        deadline = time.monotonic() + self.flush_seconds
+        while len(rows) < self.batch_size:
+            try:
+                row = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if row is _STOP:
+                return self._drain(rows), True
+            rows.append(row)
+        return rows, False
+
+    def _drain(self, rows):
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                return rows
+            if row is not _STOP:
+                rows.append(row)
+
+    def _insert(self, connection, rows):
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        totals = rollup_rows(rows, self.shift_starts)
+        with self._commit_lock:
+            try:
+                with connection:
+                    connection.executemany(
+                        f"INSERT INTO inspections ({', '.join(COLUMNS)}) VALUES ({placeholders})", rows
+                    )
+                    _upsert_rollups(connection, totals)
+                failed = False
+            except sqlite3.Error:
+                logger.exception("Failed to write %d inspections to %s", len(rows), self.path)
+                failed = True
+            # Written or lost, these rows are no longer pending
+            with self._pending_lock:
+                _merge(self._pending, totals, sign=-1)
+        if failed:
+            self.dropped += len(rows)
+            return
+        self.written += len(rows)
+        self.batches += 1
+
+    def _backfill_rollups(self, connection, chunk_size: int = 50000):
+        """Build rollups for a database written before they existed."""
+        logger.info("Building rollups from existing inspections in %s", self.path)
+        cursor = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM inspections ORDER BY id")
+        with connection:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                _upsert_rollups(connection, rollup_rows(rows, self.shift_starts))
+
+
+def _merge(target: dict, totals: dict, sign: int = 1):
+    """Add (or subtract) rollup totals into `target`, dropping buckets that reach zero."""
+    for key, (label, *values) in totals.items():
+        entry = target.get(key)
+        if entry is None:
+            entry = target[key] = [label, 0, 0, 0, 0, 0]
+        entry[1:] = [a + sign * b for a, b in zip(entry[1:], values)]
+        if entry[1] == 0:
+            del target[key]
+
+
+def _upsert_rollups(connection, totals: dict):
+    connection.executemany(UPSERT_ROLLUP, [
+        (granularity, line, start, label, *values)
+        for (granularity, line, start), (label, *values) in totals.items()
+    ])
@@ -1,15 +1,25 @@
 # backend/test_inference.py
 
 import base64
+import glob
+import os
+import sys
+
 import cv2
 import numpy as np
-from yolo_inference import process_egg_tray
+from backend.yolo_inference import BASE_DIR, process_egg_tray
+
 
-def test_backend_inference(image_path: str):
+def test_backend_inference(image_path: str = None):
     """
     Test function to run YOLO egg tray detection backend independently.
-    It reads an image, passes it to process_egg_tray, and displays the result.
+    It reads an image (the first sample image by default), passes it to
+    process_egg_tray, and saves the annotated result. Runs headless.
+
+    For latency / throughput numbers use `python -m backend.benchmark`.
     """
+    if image_path is None:
+        image_path = sorted(glob.glob(os.path.join(BASE_DIR, "sample_images_for_testing", "*.jpg")))[0]
 
     # Read image and convert to bytes (simulate frontend upload)
     with open(image_path, "rb") as f:
@@ -23,9 +33,10 @@ def test_backend_inference(image_path: str):
     image_data = base64.b64decode(result["annotated_image_base64"])
     image_np = np.frombuffer(image_data, np.uint8)
     output_img = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+    assert output_img is not None, "Annotated image could not be decoded."
 
     # Save result image locally for inspection
-    output_path = "backend/test_output.jpg"
+    output_path = os.path.join(BASE_DIR, "backend", "test_output.jpg")
     cv2.imwrite(output_path, output_img)
 
     # Print results
@@ -36,13 +47,7 @@ def test_backend_inference(image_path: str):
     print(f"Output Image    : {output_path}")
     print("=============================\n")
 
-    # Optionally display image in a window
-    cv2.imshow("Annotated Output", output_img)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-
 
 if __name__ == "__main__":
-    # 🔸 Change this path to one of your local test images
-    test_image_path = r"C:\Users\muddu krishna\Desktop\personal\projects personal\egg_identification_quality_dashboard\src\egg_identification-2\test\images\IMG_6524_MOV-0079_jpg.rf.32236270917cb39dae0dfbbf13361e03.jpg"
-    test_backend_inference(test_image_path)
+    # python -m backend.test_inference [image path]
+    test_backend_inference(sys.argv[1] if len(sys.argv) > 1 else None)
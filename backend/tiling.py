@@ -0,0 +1,145 @@
+# backend/tiling.py
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+
+def tile_starts(length: int, tile_size: int, overlap: float):
+    """Start offsets of tiles covering `length` pixels; the last tile ends flush with the edge."""
+    if length <= tile_size:
+        return [0]
+    stride = max(int(tile_size * (1 - overlap)), 1)
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def make_tiles(frame, tile_size: int, overlap: float):
+    """
+    Overlapping tile_size x tile_size views of a frame (no copies) and
+    their (x, y) offsets in the frame.
+    """
+    h, w = frame.shape[:2]
+    tiles, offsets = [], []
+    for y in tile_starts(h, tile_size, overlap):
+        for x in tile_starts(w, tile_size, overlap):
+            tiles.append(frame[y:y + tile_size, x:x + tile_size])
+            offsets.append((x, y))
+    return tiles, np.array(offsets, dtype=np.float32).reshape(-1, 2)
+
+
+def merge_detections(boxes, scores, threshold: float = 0.5, priority=None):
+    """
+    Greedy NMS across tile seams; returns the indices to keep.
+
+    Overlap is measured as intersection over the *smaller* box, so the
+    clipped half of an egg cut by one tile's edge merges into the whole egg
+    found by its neighbour. Boxes are ranked by `priority` first (e.g. not
+    touching a tile edge), then by score.
+
+    Instead of an N x N matrix, a sort-and-sweep over x pairs each box only
+    with the boxes starting inside its x-range; their overlaps are computed
+    in one vectorized step and the greedy pass walks overlapping pairs only.
+    """
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, dtype=int)
+    priority = np.zeros(n) if priority is None else priority
+    order = np.lexsort((-scores, -priority))
+    b = boxes[order]
+
+    # Candidate pairs (i, j) in x order: box j starts before box i ends
+    by_x = np.argsort(b[:, 0], kind="stable")
+    ends = np.searchsorted(b[by_x, 0], b[by_x, 2], side="left")
+    counts = np.maximum(ends - np.arange(n) - 1, 0)
+    first = np.repeat(np.arange(n), counts)
+    second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = by_x[first], by_x[second]
+
+    inter_w = np.minimum(b[i, 2], b[j, 2]) - np.maximum(b[i, 0], b[j, 0])
+    inter_h = np.clip(np.minimum(b[i, 3], b[j, 3]) - np.maximum(b[i, 1], b[j, 1]), 0, None)
+    areas = np.maximum(b[:, 2] - b[:, 0], 0) * np.maximum(b[:, 3] - b[:, 1], 0)
+    smaller = np.maximum(np.minimum(areas[i], areas[j]), 1e-6)
+    overlapping = np.clip(inter_w, 0, None) * inter_h / smaller > threshold
+
+    # Lower index = higher rank; a box is final once every higher-ranked box was visited
+    winner = np.minimum(i, j)[overlapping]
+    loser = np.maximum(i, j)[overlapping]
+    pair_order = np.argsort(winner, kind="stable")
+    keep = np.ones(n, dtype=bool)
+    for w, l in zip(winner[pair_order].tolist(), loser[pair_order].tolist()):
+        if keep[w]:
+            keep[l] = False
+    return np.sort(order[keep])
+
+
+# --------------------------------------------------
+# Sliced Inference for High-resolution Frames
+# --------------------------------------------------
+def predict_tiled(model, frames: list, tile_size: int = 640, overlap: float = 0.2, batch_size: int = 16,
+                  merge_threshold: float = 0.5, **predict_kwargs):
+    """
+    Detect small objects in large frames: every frame is cut into
+    overlapping tiles, tiles of all frames go through `model.predict` in
+    batches of `batch_size` at imgsz=tile_size, and the boxes are shifted
+    back to frame coordinates and merged across seams.
+
+    Returns one ultralytics Results per frame, like `model.predict`.
+    """
+    tiles, owners, offsets, edges, rects = [], [], [], [], []
+    for index, frame in enumerate(frames):
+        frame_tiles, frame_offsets = make_tiles(frame, tile_size, overlap)
+        h, w = frame.shape[:2]
+        tiles.extend(frame_tiles)
+        owners.extend([index] * len(frame_tiles))
+        offsets.append(frame_offsets)
+        rects.append(np.column_stack([frame_offsets, np.minimum(frame_offsets + tile_size, (w, h))]))
+        # Tile sides that lie inside the frame, where objects get cut: left, top, right, bottom
+        edges.append(np.stack([frame_offsets[:, 0] > 0, frame_offsets[:, 1] > 0,
+                               frame_offsets[:, 0] + tile_size < w, frame_offsets[:, 1] + tile_size < h], axis=1))
+    offsets = np.concatenate(offsets)
+    edges = np.concatenate(edges)
+    owners = np.array(owners)
+
+    detections = []  # per tile: (N, 8) x1, y1, x2, y2, conf, cls in frame coordinates, cut by a tile edge, tile
+    for start in range(0, len(tiles), batch_size):
+        results = model.predict(source=tiles[start:start + batch_size], imgsz=tile_size, verbose=False,
+                                **predict_kwargs)
+        for tile_index, result in enumerate(results, start=start):
+            data = result.boxes.data.cpu().numpy()[:, :6].astype(np.float32)
+            tile_h, tile_w = result.orig_shape
+            margin = 2  # pixels
+            cut = ((edges[tile_index, 0] & (data[:, 0] <= margin))
+                   | (edges[tile_index, 1] & (data[:, 1] <= margin))
+                   | (edges[tile_index, 2] & (data[:, 2] >= tile_w - margin))
+                   | (edges[tile_index, 3] & (data[:, 3] >= tile_h - margin)))
+            data[:, :4] += np.tile(offsets[tile_index], 2)
+            detections.append(np.column_stack([data, cut, np.full(len(data), tile_index)]))
+
+    merged = []
+    for index, frame in enumerate(frames):
+        frame_tiles = np.flatnonzero(owners == index)
+        data = np.concatenate([detections[i] for i in frame_tiles])
+        keep = _merge_seams(data, frame_tiles, rects[index], merge_threshold)
+        merged.append(Results(frame, path="", names=model.names, boxes=torch.from_numpy(data[keep, :6])))
+    return merged
+
+
+def _merge_seams(data, frame_tiles, tile_rects, threshold: float):
+    """
+    Indices of the detections to keep for one frame. Each tile was already
+    deduplicated by the model's own NMS, so only boxes reaching into
+    another tile can have a duplicate; only those go through
+    merge_detections.
+    """
+    boxes, own_tile = data[:, :4], np.searchsorted(frame_tiles, data[:, 7])
+    reaches = ((boxes[:, None, 0] < tile_rects[None, :, 2]) & (boxes[:, None, 2] > tile_rects[None, :, 0])
+               & (boxes[:, None, 1] < tile_rects[None, :, 3]) & (boxes[:, None, 3] > tile_rects[None, :, 1]))
+    reaches[np.arange(len(data)), own_tile] = False
+    seam = np.flatnonzero(reaches.any(axis=1))
+
+    # Whole boxes win over boxes clipped by a tile edge, then the more confident one
+    kept_seam = seam[merge_detections(boxes[seam], data[seam, 4], threshold, priority=1 - data[seam, 6])]
+    inner = np.setdiff1d(np.arange(len(data)), seam)
+    return np.sort(np.concatenate([inner, kept_seam]))
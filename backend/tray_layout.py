@@ -0,0 +1,185 @@
+# backend/tray_layout.py
+
+import numpy as np
+
+
+# Tray formats as rows x cols (rows run down the image)
+LAYOUTS = {
+    "6x5": (6, 5),
+    "5x6": (5, 6),
+    "10x3": (10, 3),
+}
+
+# Per-slot states in TrayGrid.states
+MISSING = -1
+EMPTY = 0
+EGG = 1
+
+
+def parse_layout(layout):
+    """(rows, cols) from a name in LAYOUTS, "RxC", or a (rows, cols) pair."""
+    if isinstance(layout, str):
+        if layout in LAYOUTS:
+            return LAYOUTS[layout]
+        try:
+            rows, cols = (int(v) for v in layout.lower().split("x"))
+        except ValueError:
+            raise ValueError(f"Unknown tray layout '{layout}'. Use one of {list(LAYOUTS)} or 'RxC'.")
+        return rows, cols
+    rows, cols = layout
+    return int(rows), int(cols)
+
+
+def _fit_axis(centers, count: int, box_size: float, limit: float):
+    """
+    First position and pitch of `count` evenly spaced rows (or columns)
+    explaining the 1-D detection centres. Centres closer than half a box
+    are one row; rows with no detection at all are filled in on the side
+    of the tray with more room in the image.
+    """
+    values = np.sort(centers)
+    starts = np.r_[0, np.flatnonzero(np.diff(values) > box_size / 2) + 1]
+    sizes = np.diff(np.r_[starts, len(values)])
+    means = np.add.reduceat(values, starts) / sizes
+    if count == 1:
+        # A single row: stray detections off it must not stretch the pitch; anchor on the densest cluster
+        return float(means[np.argmax(sizes)]), float(box_size)
+    if len(means) == 1:
+        pitch = box_size
+        first = means[0]
+        seen = 1
+    else:
+        # Gaps may skip empty rows, so index every row by the smallest gap and refine by least squares
+        gap = np.diff(means).min()
+        index = np.rint((means - means[0]) / gap)
+        index_mean, mean = index.mean(), means.mean()
+        pitch = ((index - index_mean) * (means - mean)).sum() / ((index - index_mean) ** 2).sum()
+        first = mean - pitch * index_mean
+        seen = int(index[-1]) + 1
+        if seen > count:
+            # More rows than the layout has: spread the layout evenly over the detections instead
+            pitch = (means[-1] - means[0]) / (count - 1)
+            first = means[0]
+            seen = count
+
+    # Whole rows missing: add them where the tray has room to extend
+    for _ in range(count - seen):
+        room_before = first - pitch / 2
+        room_after = limit - (first + seen * pitch - pitch / 2)
+        if room_before > room_after:
+            first -= pitch
+        seen += 1
+    return float(first), float(pitch)
+
+
+# --------------------------------------------------
+# Slot Grid of One Tray
+# --------------------------------------------------
+class TrayGrid:
+    """
+    A rows x cols tray fitted to one image: slot (r, c) is centred at
+    `origin + (c * pitch_x, r * pitch_y)`, so the pixel position of any
+    slot is two multiply-adds for reject actuators.
+
+    `states` holds EGG / EMPTY / MISSING per slot (row-major); MISSING
+    means no detection landed on the slot at all. `unassigned` counts
+    boxes that fell off the grid or lost their slot to a better one.
+    """
+
+    def __init__(self, rows: int, cols: int, origin, pitch, states, unassigned: int = 0):
+        self.rows = rows
+        self.cols = cols
+        self.origin = origin
+        self.pitch = pitch
+        self.states = states
+        self.unassigned = unassigned
+
+    @property
+    def num_missing(self) -> int:
+        return int(np.count_nonzero(self.states == MISSING))
+
+    @property
+    def full(self) -> bool:
+        """Every slot holds an egg."""
+        return bool(np.all(self.states == EGG))
+
+    @property
+    def layout(self) -> str:
+        return f"{self.rows}x{self.cols}"
+
+    def slot_center(self, row: int, col: int):
+        return (self.origin[0] + col * self.pitch[0], self.origin[1] + row * self.pitch[1])
+
+    def slot_centers(self) -> np.ndarray:
+        """(rows * cols, 2) x, y centres in row-major order."""
+        rows, cols = np.divmod(np.arange(self.rows * self.cols), self.cols)
+        return np.stack([self.origin[0] + cols * self.pitch[0], self.origin[1] + rows * self.pitch[1]], axis=1)
+
+    def bitmap(self, state: int) -> int:
+        """Bit i (row-major slot index) set where the slot is in `state`."""
+        return sum(1 << int(i) for i in np.flatnonzero(self.states == state))
+
+    def summary(self) -> dict:
+        """JSON-ready occupancy: bitmaps, grid geometry and the slots needing attention."""
+        flagged = np.flatnonzero(self.states != EGG)
+        centers = np.rint(self.slot_centers()[flagged]).astype(int).tolist()
+        return {
+            "layout": self.layout,
+            "occupancy_bitmap": self.bitmap(EGG),
+            "missing_bitmap": self.bitmap(MISSING),
+            "grid": {
+                "origin": [round(self.origin[0], 1), round(self.origin[1], 1)],
+                "pitch": [round(self.pitch[0], 1), round(self.pitch[1], 1)],
+            },
+            "flagged_slots": [
+                {"row": int(i // self.cols), "col": int(i % self.cols),
+                 "state": "missing" if self.states[i] == MISSING else "empty", "center": center}
+                for i, center in zip(flagged, centers)
+            ],
+        }
+
+
+def fit_tray(boxes, is_egg, confidences, layout, image_shape) -> TrayGrid:
+    """
+    Fit a rows x cols grid to one tray's detections and assign every box to
+    its nearest slot in one vectorized step; where several boxes land on a
+    slot the most confident one decides its state.
+
+    boxes : (N, 4) x1, y1, x2, y2 · is_egg : (N,) bool · image_shape : (h, w)
+    """
+    rows, cols = parse_layout(layout)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        h, w = image_shape[:2]
+        return TrayGrid(rows, cols, (w / (2 * cols), h / (2 * rows)), (w / cols, h / rows),
+                        np.full(rows * cols, MISSING, dtype=np.int8))
+
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    box_w, box_h = np.median(boxes[:, 2] - boxes[:, 0]), np.median(boxes[:, 3] - boxes[:, 1])
+    x0, pitch_x = _fit_axis(centers[:, 0], cols, box_w, image_shape[1])
+    y0, pitch_y = _fit_axis(centers[:, 1], rows, box_h, image_shape[0])
+
+    # Nearest slot of every detection; boxes off the grid are ignored
+    col = np.rint((centers[:, 0] - x0) / pitch_x).astype(int)
+    row = np.rint((centers[:, 1] - y0) / pitch_y).astype(int)
+    on_grid = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)
+    slot = (row * cols + col)[on_grid]
+    state = np.asarray(is_egg, dtype=np.int8)[on_grid]
+    confidence = np.asarray(confidences, dtype=np.float64)[on_grid]
+
+    # Most confident box per slot: sort by slot, then confidence descending, keep the first of each slot
+    order = np.lexsort((-confidence, slot))
+    slot, state = slot[order], state[order]
+    first = np.ones(len(slot), dtype=bool)
+    first[1:] = slot[1:] != slot[:-1]
+
+    states = np.full(rows * cols, MISSING, dtype=np.int8)
+    states[slot[first]] = state[first]
+    unassigned = len(boxes) - int(np.count_nonzero(first))
+    return TrayGrid(rows, cols, (x0, y0), (pitch_x, pitch_y), states, unassigned)
+
+
+def best_fit_tray(boxes, is_egg, confidences, layouts, image_shape) -> TrayGrid:
+    """The candidate layout that explains the detections best: fewest missing slots and stray boxes."""
+    grids = [fit_tray(boxes, is_egg, confidences, layout, image_shape) for layout in layouts]
+    return min(grids, key=lambda grid: grid.num_missing + grid.unassigned)
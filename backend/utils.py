@@ -1,28 +1,91 @@
 import cv2
+import numpy as np
 
-def draw_neon_corner_box(frame, x1, y1, x2, y2, color=(0, 255, 255), thickness=2, corner_len=15, glow_intensity=0.4):
+
+def _blend_box(frame, x1, y1, x2, y2, color, glow_intensity):
     """
-    Draws a glowing neon-style corner box around the object.
-    Combines neon glow + corner-only minimalistic box.
+    Blend a filled rectangle into the frame, touching only the box ROI.
+    Pixel-identical to blending a full-frame overlay, since pixels outside
+    the box are unchanged by the full-frame blend anyway.
+    """
+    h, w = frame.shape[:2]
+    x1c, y1c = max(x1, 0), max(y1, 0)
+    x2c, y2c = min(x2, w - 1), min(y2, h - 1)
+    if x1c > x2c or y1c > y2c:
+        return
+
+    roi = frame[y1c:y2c + 1, x1c:x2c + 1]
+    fill = np.empty_like(roi)
+    fill[:] = color
+    frame[y1c:y2c + 1, x1c:x2c + 1] = cv2.addWeighted(fill, glow_intensity, roi, 1 - glow_intensity, 0)
+
+
+def _corner_segments(boxes, corner_len):
+    """
+    Build the 8 corner line segments of every box as one (N*8, 2, 2) array.
+    """
+    x1, y1, x2, y2 = (boxes[:, i] for i in range(4))
+    segments = np.stack([
+        # top-left
+        np.stack([x1, y1, x1 + corner_len, y1], axis=1),
+        np.stack([x1, y1, x1, y1 + corner_len], axis=1),
+        # top-right
+        np.stack([x2, y1, x2 - corner_len, y1], axis=1),
+        np.stack([x2, y1, x2, y1 + corner_len], axis=1),
+        # bottom-left
+        np.stack([x1, y2, x1 + corner_len, y2], axis=1),
+        np.stack([x1, y2, x1, y2 - corner_len], axis=1),
+        # bottom-right
+        np.stack([x2, y2, x2 - corner_len, y2], axis=1),
+        np.stack([x2, y2, x2, y2 - corner_len], axis=1),
+    ], axis=1)
+    return segments.reshape(-1, 2, 2).astype(np.int32)
+
+
+def draw_neon_corner_boxes(frame, boxes, colors, labels=None, label_colors=None, thickness=2,
+                           corner_len=15, glow_intensity=0.4, font_scale=0.6, label_offset=8):
     """
+    Draws glowing neon-style corner boxes for all detections in one pass.
 
-    # --- Neon glow overlay ---
-    overlay = frame.copy()
-    cv2.rectangle(overlay, (x1, y1), (x2, y2), color, -1)
-    cv2.addWeighted(overlay, glow_intensity, frame, 1 - glow_intensity, 0, frame)
-
-    # --- Corner-style edges ---
-    # top-left
-    cv2.line(frame, (x1, y1), (x1 + corner_len, y1), color, thickness)
-    cv2.line(frame, (x1, y1), (x1, y1 + corner_len), color, thickness)
-    # top-right
-    cv2.line(frame, (x2, y1), (x2 - corner_len, y1), color, thickness)
-    cv2.line(frame, (x2, y1), (x2, y1 + corner_len), color, thickness)
-    # bottom-left
-    cv2.line(frame, (x1, y2), (x1 + corner_len, y2), color, thickness)
-    cv2.line(frame, (x1, y2), (x1, y2 - corner_len), color, thickness)
-    # bottom-right
-    cv2.line(frame, (x2, y2), (x2 - corner_len, y2), color, thickness)
-    cv2.line(frame, (x2, y2), (x2, y2 - corner_len), color, thickness)
+    Instead of copying and blending the whole frame once per box, each glow
+    is blended into its own box ROI, then all corner segments of one color
+    are drawn with a single polylines call, then the labels. Cost grows
+    with the boxed area rather than with frame size × box count.
+
+    boxes        : (N, 4) array-like of x1, y1, x2, y2
+    colors       : one BGR color per box
+    labels       : optional text drawn above each box
+    label_colors : optional text color per box (defaults to the box color)
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return frame
+    colors = [tuple(int(c) for c in color) for color in colors]
+
+    # --- Neon glow, ROI-only blending ---
+    for (x1, y1, x2, y2), color in zip(boxes.tolist(), colors):
+        _blend_box(frame, x1, y1, x2, y2, color, glow_intensity)
+
+    # --- Corner-style edges, one draw call per color ---
+    segments = _corner_segments(boxes, corner_len)
+    for color in set(colors):
+        mask = np.repeat([c == color for c in colors], 8)
+        cv2.polylines(frame, list(segments[mask]), False, color, thickness)
+
+    # --- Labels above boxes ---
+    if labels is not None:
+        label_colors = label_colors or colors
+        for (x1, y1, _, _), text, color in zip(boxes.tolist(), labels, label_colors):
+            cv2.putText(frame, text, (x1, y1 - label_offset),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, 2)
 
     return frame
+
+
+def draw_neon_corner_box(frame, x1, y1, x2, y2, color=(0, 255, 255), thickness=2, corner_len=15, glow_intensity=0.4):
+    """
+    Draws a glowing neon-style corner box around the object.
+    Combines neon glow + corner-only minimalistic box.
+    """
+    return draw_neon_corner_boxes(frame, [(x1, y1, x2, y2)], [color], thickness=thickness,
+                                  corner_len=corner_len, glow_intensity=glow_intensity)
@@ -0,0 +1,94 @@
+# backend/worker_pool.py
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# --------------------------------------------------
+# Bounded CPU Worker Pool
+# --------------------------------------------------
+class InferenceWorkerPool:
+    """
+    Runs CPU-bound inference work off the asyncio event loop.
+
+    kind="thread"  → ThreadPoolExecutor (threads borrow model instances
+                     from the shared ModelManager)
+    kind="process" → ProcessPoolExecutor using the "spawn" start method,
+                     so each worker imports and loads its own model.
+
+    At most `max_workers` jobs run at the same time; callers that need
+    admission control bound their own queue in front of the pool.
+    `initializer(*initargs)` runs once in every worker process (e.g. to
+    load a model); `replace` swaps in a fresh set of processes.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: int = 2, initializer=None, initargs=()):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker pool kind '{kind}'. Use 'thread' or 'process'.")
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+
+    def start(self):
+        """Create the underlying executor."""
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        if self.kind == "process":
+            return ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.initializer,
+                initargs=self.initargs,
+            )
+        return ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference",
+        )
+
+    def shutdown(self):
+        """Stop accepting work and release the workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on a worker and await its result."""
+        if self._executor is None:
+            raise RuntimeError("Worker pool is not running.")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def warm_up(self, fn, executor=None):
+        """
+        Submit one `fn` job per worker at the same time, so every worker
+        is started (and its initializer has run) before real traffic.
+        """
+        executor = executor or self._executor
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, fn) for _ in range(self.max_workers)))
+
+    async def replace(self, warm_fn, initargs=()):
+        """
+        Start and warm a new set of workers with `initargs`, then swap them
+        in. Jobs already running on the old workers finish there before
+        the old executor shuts down; on failure the old workers stay.
+        """
+        previous_initargs = self.initargs
+        self.initargs = initargs
+        executor = self._create_executor()
+        try:
+            await self.warm_up(warm_fn, executor)
+        except Exception:
+            self.initargs = previous_initargs
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        old, self._executor = self._executor, executor
+        if old is not None:
+            await asyncio.to_thread(old.shutdown, wait=True)
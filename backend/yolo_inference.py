@@ -1,81 +1,284 @@
 # backend/yolov8_inference.py
 
 import os
+import time
 import yaml
 import cv2
 import base64
 import numpy as np
-from ultralytics import YOLO
-from backend.utils  import draw_neon_corner_box  
+from concurrent.futures import ThreadPoolExecutor
+from backend.inference_backends import exported_weights_path
+from backend.metrics import batch_size, stage_seconds, timed
+from backend.model_manager import ModelManager
+from backend.tiling import predict_tiled
+from backend.tray_layout import LAYOUTS, best_fit_tray, parse_layout
+from backend.utils  import draw_neon_corner_boxes
 
 # Load configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-yaml_path = os.path.join(BASE_DIR, "inference_phams.yaml")
+# INFERENCE_PARAMS points at another settings file (e.g. the benchmark's server)
+yaml_path = os.environ.get("INFERENCE_PARAMS") or os.path.join(BASE_DIR, "inference_phams.yaml")
 
 with open(yaml_path, "r") as f:
     params = yaml.safe_load(f)
 
 traind_model_path = os.path.join(BASE_DIR, "model/best.pt")
 
-# Load YOLO model
-model_path = traind_model_path
-model = YOLO(model_path)
-class_list = model.names
+# PyTorch weights, or their ONNX / OpenVINO export (python -m backend.export_model)
+inference_backend = params.get("inference_backend", "torch")
+model_path = exported_weights_path(traind_model_path, inference_backend)
+
+# YOLO model is loaded lazily (on FastAPI startup or first use), not at import
+model_manager = ModelManager(
+    model_path,
+    warmup_runs=params.get("warmup_runs", 1),
+    warmup_imgsz=params.get("warmup_imgsz", 640),
+)
+
+
+# Expected tray grid: one layout, "auto" (best of LAYOUTS) or "none" (plain box counting)
+tray_layout = str(params.get("tray_layout", "auto"))
+if tray_layout == "none":
+    tray_layouts = []
+elif tray_layout == "auto":
+    tray_layouts = list(LAYOUTS.values())
+else:
+    tray_layouts = [parse_layout(tray_layout)]
+
+# cv2.imdecode releases the GIL, so the images of a batch decode on several cores
+decode_pool = ThreadPoolExecutor(
+    max_workers=params.get("decode_workers") or min(4, os.cpu_count() or 1),
+    thread_name_prefix="decode",
+)
+
+
+def init_worker(weights_path: str = None):
+    """Process-pool initializer: load and warm this worker's model."""
+    if weights_path:
+        model_manager.model_path = weights_path
+    model_manager.ensure_loaded()
+
+
+def ping():
+    """No-op job used to make a worker process start (and warm up)."""
+    return model_manager.state
 
 # --------------------------------------------------
-# Main Inference Function
+# Helper Functions
 # --------------------------------------------------
-def process_egg_tray(image_bytes: bytes):
+def decode_image(image_bytes: bytes):
     """
-    Perform YOLO inference on uploaded egg tray image.
-    Counts eggs & empty slots, draws glowing corner boxes,
-    and returns annotated image + metrics as JSON.
+    Decode uploaded image bytes into a BGR frame.
+    Raises ValueError when the bytes are not a readable image.
     """
-
-    # Convert image bytes → numpy array
     image_array = np.frombuffer(image_bytes, np.uint8)
     frame = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
     if frame is None:
         raise ValueError("Invalid image data received.")
+    return frame
+
+
+# JPEG start-of-frame markers (SOF0-SOF15 without DHT, JPG and DAC)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# DCT-domain downscaling flags, largest reduction first
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def jpeg_size(image_bytes):
+    """(width, height) from a JPEG header without decoding, or None for other formats."""
+    data = memoryview(image_bytes)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def decode_tray_image(image_bytes: bytes):
+    """
+    Decode an upload at the smallest size the model still sees in full.
+
+    YOLO letterboxes every frame to `imgsz` anyway, so a large JPEG is
+    decoded with libjpeg's DCT-domain downscaling (1/2, 1/4 or 1/8) as long
+    as its longest side stays >= imgsz: less decode time and a frame a
+    fraction of the size. Returns (frame, scale), where `scale` maps frame
+    pixels back to the original image. Other formats, small images and
+    sliced inference (which needs full resolution) decode as before.
+    """
+    with timed("decode"):
+        min_side = params.get("imgsz", 640)
+        size = jpeg_size(image_bytes) if params.get("reduced_decode", True) and not params.get("tile_size") else None
+        if size is not None:
+            for factor, flag in _REDUCED_FLAGS:
+                if max(size) / factor >= min_side:
+                    frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+                    if frame is None:
+                        raise ValueError("Invalid image data received.")
+                    # Longest sides: EXIF rotation may swap width and height
+                    return frame, max(size) / max(frame.shape[:2])
+        return decode_image(image_bytes), 1.0
+
+
+def _try_decode(image_bytes: bytes):
+    try:
+        return decode_tray_image(image_bytes)
+    except ValueError as e:
+        return e
+
+
+def decode_images(images_bytes: list):
+    """
+    Decode several uploads in parallel on the decode pool.
+    Each entry is a (frame, scale) pair from decode_tray_image or the
+    ValueError raised for that image.
+    """
+    if len(images_bytes) < 2:
+        return [_try_decode(image_bytes) for image_bytes in images_bytes]
+    return list(decode_pool.map(_try_decode, images_bytes))
 
-    # Run YOLO inference
-    results = model.predict(
-        source=frame,
-        conf=params.get("confidence_threshold", 0.5),
-        classes=params.get("classes_to_track", None),
-        verbose=False
-    )
-
-    # Initialize counts
-    num_eggs = 0
-    num_empty_slots = 0
-
-    # Draw neon corner boxes
-    for r in results:
-        boxes = r.boxes
-        for box in boxes:
-            cls_id = int(box.cls[0])
-            cls_name = class_list[cls_id]
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            conf = float(box.conf[0])
-
-            # Choose color
-            if cls_name.lower() == "egg":
-                color = (0, 255, 0)       # Neon Green
-                num_eggs += 1
-            else:
-                color = (0, 0, 255)       # Neon Red
-                num_empty_slots += 1
-
-            # Draw custom glowing corner box
-            frame = draw_neon_corner_box(frame, x1, y1, x2, y2, color=color, thickness=2, corner_len=20, glow_intensity=0.3)
-
-            # Add label above box
-            cv2.putText(frame, f"{cls_name} {conf:.2f}", (x1, y1 - 8),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+def run_detection(frames: list):
+    """
+    Run a single batched YOLO predict call over a list of frames.
+    Returns one ultralytics Results object per frame, in order.
+
+    With `tile_size` set, frames larger than one tile are sliced into
+    overlapping tiles instead (see tiling.predict_tiled), so eggs on
+    high-resolution stack photos are not shrunk to a few pixels.
+    """
+    conf = params.get("confidence_threshold", 0.5)
+    classes = params.get("classes_to_track", None)
+    tile_size = params.get("tile_size", 0)
+    batch_size.observe(len(frames))
+    with model_manager.acquire() as model, timed("predict"):
+        if not tile_size:
+            return model.predict(source=list(frames), conf=conf, classes=classes, verbose=False)
+
+        results = [None] * len(frames)
+        large = [i for i, frame in enumerate(frames) if max(frame.shape[:2]) > tile_size]
+        small = [i for i in range(len(frames)) if i not in large]
+        if small:
+            for i, result in zip(small, model.predict(source=[frames[i] for i in small], conf=conf,
+                                                      classes=classes, verbose=False)):
+                results[i] = result
+        if large:
+            tiled = predict_tiled(
+                model, [frames[i] for i in large],
+                tile_size=tile_size,
+                overlap=params.get("tile_overlap", 0.2),
+                batch_size=params.get("tile_batch_size", 16),
+                merge_threshold=params.get("tile_merge_threshold", 0.5),
+                conf=conf, classes=classes,
+            )
+            for i, result in zip(large, tiled):
+                results[i] = result
+        return results
+
+
+def extract_detections(result, scale: float = 1.0):
+    """
+    Pull boxes, confidences and class names out of one YOLO result
+    as plain JSON-serialisable lists (no drawing involved). Boxes are
+    multiplied by `scale`, i.e. given in original image pixels.
+    """
+    boxes = result.boxes
+    class_ids = boxes.cls.cpu().numpy().astype(int)
+    return {
+        "boxes": (boxes.xyxy.cpu().numpy() * scale).astype(int).tolist(),
+        "confidences": np.round(boxes.conf.cpu().numpy(), 3).tolist(),
+        "classes": [result.names[c] for c in class_ids],
+    }
+
+
+def count_tray(detections, image_shape=None):
+    """
+    Count eggs & empty slots and derive the tray status.
+
+    With a tray layout configured, detections are also fitted to the slot
+    grid: the tray is only OK when every slot holds an egg, so slots with
+    no detection at all no longer pass, and "tray_layout" reports the
+    per-slot occupancy bitmap and the flagged slots' coordinates.
+    """
+    is_egg = np.array([name.lower() == "egg" for name in detections["classes"]], dtype=bool)
+    num_eggs = int(is_egg.sum())
+    num_empty_slots = len(detections["classes"]) - num_eggs
 
     # Determine tray status
     tray_status = "OK" if num_empty_slots == 0 else "Not OK"
+    metrics = {
+        "num_eggs": num_eggs,
+        "num_empty_slots": num_empty_slots,
+        "tray_status": tray_status,
+    }
+
+    if tray_layouts and image_shape is not None:
+        with timed("layout"):
+            grid = best_fit_tray(detections["boxes"], is_egg, detections["confidences"], tray_layouts, image_shape)
+            metrics["num_missing_slots"] = grid.num_missing
+            metrics["tray_status"] = "OK" if grid.full else "Not OK"
+            metrics["tray_layout"] = grid.summary()
+
+    return metrics
+
+
+def original_shape(shape, scale: float = 1.0):
+    """(height, width) of the uploaded image a (possibly reduced) frame was decoded from."""
+    return round(shape[0] * scale), round(shape[1] * scale)
+
+
+def summarize_tray(result, scale: float = 1.0):
+    """
+    Metrics-only response: counts, tray status and raw detections,
+    without rendering or encoding an image.
+    """
+    detections = extract_detections(result, scale)
+    return {**count_tray(detections, original_shape(result.orig_shape, scale)), "detections": detections}
+
+
+def analyse_tray(frame, result, scale: float = 1.0):
+    """
+    Count eggs & empty slots for one frame and draw glowing corner boxes.
+    Returns (metrics dict, annotated frame).
+
+    Metrics are in original image pixels; drawing happens on the frame as
+    decoded, so a reduced frame gets an equally reduced annotated image.
+    """
+    detections = extract_detections(result, scale)
+    metrics = count_tray(detections, original_shape(frame.shape, scale))
+
+    draw_start = time.perf_counter()
+
+    # Choose color: Neon Green for eggs, Neon Red for empty slots
+    colors = [(0, 255, 0) if name.lower() == "egg" else (0, 0, 255) for name in detections["classes"]]
+    labels = [f"{name} {conf:.2f}" for name, conf in zip(detections["classes"], detections["confidences"])]
+
+    # Draw all glowing corner boxes and labels in one pass
+    boxes = detections["boxes"] if scale == 1.0 else (np.asarray(detections["boxes"]) / scale).astype(int).tolist()
+    frame = draw_neon_corner_boxes(frame, boxes, colors, labels=labels,
+                                   thickness=2, corner_len=20, glow_intensity=0.3)
+
+    # Mark slots without any detection so operators see what was missed
+    if "tray_layout" in metrics:
+        pitch = metrics["tray_layout"]["grid"]["pitch"]
+        radius = max(int(min(pitch) / scale / 3), 4)
+        for slot in metrics["tray_layout"]["flagged_slots"]:
+            if slot["state"] == "missing":
+                center = (int(slot["center"][0] / scale), int(slot["center"][1] / scale))
+                cv2.circle(frame, center, radius, (0, 255, 255), 2, cv2.LINE_AA)
+
+    tray_status = metrics["tray_status"]
 
     # Overlay summary text in a more aesthetic way
     status_text = f"Tray: {tray_status}"
@@ -98,15 +301,124 @@ def process_egg_tray(image_bytes: bytes):
     cv2.putText(frame, status_text, (rect_x + 15, rect_y),
                 font, 1, text_color, 2, cv2.LINE_AA)
 
+    stage_seconds.observe(time.perf_counter() - draw_start, "draw")
+    return metrics, frame
+
+
+def encode_image(frame):
+    """
+    Encode an annotated frame with the configured format and quality.
+    Returns (image bytes, media type).
+    """
+    image_format = params.get("image_format", "jpg").lower()
+    quality = int(params.get("image_quality", 95))
+
+    with timed("encode"):
+        if image_format == "webp":
+            ok, buffer = cv2.imencode(".webp", frame, [cv2.IMWRITE_WEBP_QUALITY, quality])
+            media_type = "image/webp"
+        else:
+            ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            media_type = "image/jpeg"
+    if not ok:
+        raise RuntimeError(f"Failed to encode annotated image as {image_format}.")
+    return buffer.tobytes(), media_type
+
+
+def annotate_tray(frame, result, output: str = "base64", scale: float = 1.0):
+    """
+    Count eggs & empty slots for one frame, draw glowing corner boxes,
+    and return annotated image + metrics as JSON.
+
+    output="bytes" returns the encoded image as raw bytes under
+    "annotated_image" (plus its "media_type") instead of base64.
+    """
+    metrics, frame = analyse_tray(frame, result, scale)
+    image, media_type = encode_image(frame)
+
+    if output == "bytes":
+        return {**metrics, "annotated_image": image, "media_type": media_type}
 
     # Convert annotated image → base64 for frontend
-    _, buffer = cv2.imencode(".jpg", frame)
-    encoded_image = base64.b64encode(buffer).decode("utf-8")
+    with timed("base64"):
+        encoded_image = base64.b64encode(image).decode("utf-8")
 
     # Construct response
-    return {
-        "num_eggs": num_eggs,
-        "num_empty_slots": num_empty_slots,
-        "tray_status": tray_status,
-        "annotated_image_base64": encoded_image
-    }
+    return {**metrics, "annotated_image_base64": encoded_image}
+
+
+def build_response(frame, result, output: str = "base64", scale: float = 1.0):
+    """
+    Build the response for one frame in the requested output mode:
+    "base64" (default), "bytes" or "metrics" (no rendering at all).
+    `scale` maps frame pixels to original image pixels (decode_tray_image).
+    """
+    if output == "metrics":
+        return summarize_tray(result, scale)
+    return annotate_tray(frame, result, output, scale)
+
+# --------------------------------------------------
+# Main Inference Functions
+# --------------------------------------------------
+def process_egg_tray_batch(images_bytes: list, output="base64"):
+    """
+    Perform one batched YOLO inference over several uploaded egg tray images.
+
+    `output` is either one mode for the whole batch or a list of modes
+    aligned with `images_bytes` (see build_response); "metrics" images skip
+    drawing and encoding and get the summarize_tray response instead.
+
+    Returns a list aligned with the input. Each entry is either the JSON
+    result of process_egg_tray or the exception raised for that image
+    (e.g. ValueError for unreadable bytes), so one bad upload does not
+    fail the rest of the batch.
+    """
+    if isinstance(output, str):
+        output = [output] * len(images_bytes)
+
+    outputs = [None] * len(images_bytes)
+    frames, scales, positions = [], [], []
+
+    # Convert image bytes → numpy arrays
+    for i, decoded in enumerate(decode_images(images_bytes)):
+        if isinstance(decoded, ValueError):
+            outputs[i] = decoded
+        else:
+            frames.append(decoded[0])
+            scales.append(decoded[1])
+            positions.append(i)
+
+    if not frames:
+        return outputs
+
+    # Run YOLO inference once for the whole batch
+    results = run_detection(frames)
+
+    for i, frame, scale, result in zip(positions, frames, scales, results):
+        outputs[i] = build_response(frame, result, output[i], scale)
+
+    return outputs
+
+
+def process_tray_requests(requests: list):
+    """
+    Batch entry point for the request scheduler.
+    Each request is an (image_bytes, output) tuple.
+    """
+    images_bytes = [image_bytes for image_bytes, _ in requests]
+    output = [mode for _, mode in requests]
+    return process_egg_tray_batch(images_bytes, output)
+
+
+def process_egg_tray(image_bytes: bytes, output: str = "base64"):
+    """
+    Perform YOLO inference on uploaded egg tray image.
+    Counts eggs & empty slots, draws glowing corner boxes,
+    and returns annotated image + metrics as JSON.
+
+    With output="metrics", rendering and image encoding are skipped and
+    the counts are returned with raw boxes and confidences.
+    """
+    frame, scale = decode_tray_image(image_bytes)
+    results = run_detection([frame])
+    return build_response(frame, results[0], output, scale)
@@ -1,9 +1,5 @@
 import streamlit as st
 import requests
-from PIL import Image
-import io
-import base64
-from random import randrange
 import plotly.graph_objects as go
 import os
 from pathlib import Path
@@ -111,7 +107,10 @@ st.markdown('<div class="subtitle">Detect eggs, empty slots, and verify tray qua
 # -------------------------------
 # Backend API Configuration
 # -------------------------------
-API_URL = "http://127.0.0.1:8000/predict/"  # FastAPI backend endpoint
+API_BASE_URL = "http://127.0.0.1:8000"
+API_URL = f"{API_BASE_URL}/predict/"  # FastAPI backend endpoint
+# Ask for the annotated image as a separate raw JPEG/WebP download instead of base64 in JSON
+API_PARAMS = {"image_mode": "url"}
 
 # -----------------------------
 # Sidebar
@@ -189,7 +188,7 @@ with col1:
                 with open(sample_image_path, "rb") as f:
                     files = {"file": (sample_image_path.name, f, "image/jpeg")}
                     try:
-                        response = requests.post(API_URL, files=files, timeout=60)
+                        response = requests.post(API_URL, files=files, params=API_PARAMS, timeout=60)
                     except requests.exceptions.RequestException as e:
                         st.error(f"❌ API request failed: {e}")
                         st.stop()
@@ -197,18 +196,18 @@ with col1:
             # For uploaded files, send normally
             if uploaded_file:
                 try:
-                    response = requests.post(API_URL, files=files, timeout=60)
+                    response = requests.post(API_URL, files=files, params=API_PARAMS, timeout=60)
                 except requests.exceptions.RequestException as e:
                     st.error(f"❌ API request failed: {e}")
                     st.stop()
                     
     if predict_btn and (uploaded_file or sample_image_path) and response.status_code == 200:
         try:
-            # Decode base64 image returned from backend
+            # Fetch the raw annotated image bytes returned by the backend
             result = response.json()
-            annotated_image_base64 = result["annotated_image_base64"]
-            image_data = base64.b64decode(annotated_image_base64)
-            annotated_image = Image.open(io.BytesIO(image_data))
+            image_response = requests.get(API_BASE_URL + result["annotated_image_url"], timeout=60)
+            image_response.raise_for_status()
+            annotated_image = image_response.content
 
             st.markdown("### 🖼️ Processed Result")
             st.image(annotated_image, caption="Processed Result", use_container_width=True)
@@ -244,12 +243,14 @@ with col2:
                         <th>Tray Status</th>
                         <th>Number of Eggs</th>
                         <th>Empty Slots</th>
+                        <th>Missing Slots</th>
                     </tr>
                     <tr>
-                        <td>{randrange(10)}</td>
+                        <td>{result.get('tray_id', '-')}</td>
                         <td class="{tray_class}">{'OK ✅' if tray_ok else 'Not OK ❌'}</td>
                         <td>{result['num_eggs']}</td>
                         <td>{result['num_empty_slots']}</td>
+                        <td>{result.get('num_missing_slots', '-')}</td>
                     </tr>
                 </table>
             """, unsafe_allow_html=True)
@@ -266,27 +267,37 @@ with col2:
         st.markdown("### 📊 Detection Results")
         st.info("Upload an image to preview and process the result here.")
 # -------------------------------
+# Current Shift Totals (backend rollups)
+# -------------------------------
+shift_data = None
+if predection_completed:
+    try:
+        shift_response = requests.get(API_BASE_URL + "/rollups/current-shift", timeout=10)
+        shift_response.raise_for_status()
+        shift = shift_response.json()
+        shift_data = {
+            "Shift Date": shift["shift_date"],
+            "Shift Time": shift["shift"],
+            "Total Trays Inspected": shift["trays"],
+            "Go Trays": shift["go_trays"],
+            "No-Go Trays": shift["no_go_trays"],
+            "Total Eggs Detected": shift["eggs"],
+            "Empty Slots Detected": shift["empty_slots"]
+        }
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Failed to load shift totals: {e}")
+
+# -------------------------------
 # Layout-1
 # -------------------------------
 col3, col4 = st.columns([1, 1])
 # -------- Left Column: Upload + Metrics --------
 with col3:
-    if predection_completed:
+    if shift_data:
         try:
             # After rendering the metrics table
             st.markdown("### 📈 Production Shift Overview")
 
-            # Dummy data for visualization
-            shift_data = {
-                "Shift Date": "23-05-2025",
-                "Shift Time": "Day Shift",
-                "Operator Name": "Krish",
-                "Total Trays Inspected": 2300,
-                "Go Trays": 2000,
-                "No-Go Trays": 300,
-                "Total Eggs Detected": 10000,
-                "Empty Slots Detected": 200
-            }
 
             # Bar chart values
             categories = [
@@ -337,21 +348,10 @@ with col3:
             st.error(f"❌ Failed to load processed image: {e}")
 # -------- Right Column: Output Visualization --------
 with col4:
-    if predection_completed:
+    if shift_data:
         try:
                        
             st.markdown(" ")
-            # Dummy data for visualization
-            shift_data = {
-                "Shift Date": "23-05-2025",
-                "Shift Time": "Day Shift",
-                "Operator Name": "Krish",
-                "Total Trays Inspected": 2300,
-                "Go Trays": 2000,
-                "No-Go Trays": 300,
-                "Total Eggs Detected": 10000,
-                "Empty Slots Detected": 200
-            }
 
             # Bar chart values
             categories = [
@@ -0,0 +1,431 @@
+# src/line_counter.py
+
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+from backend.utils import draw_neon_corner_boxes
+from src.motion_gate import MotionGate
+from src.video_pipeline import StreamingPipeline, is_live_source
+from src.zones import PolygonZone
+
+
+RED, YELLOW, GREEN, WHITE = (0, 0, 255), (0, 255, 255), (0, 255, 0), (255, 255, 255)
+COLORS = (RED, YELLOW, GREEN)
+
+# Marks the end of the event stream
+_END = object()
+
+# TrackTable.counted bits for zone counting
+ENTERED, EXITED = 1, 2
+
+
+def get_side_of_line(p1, p2, cx, cy):
+    # returns positive or negative depending on which side of the line (cx, cy) is;
+    # works on scalars or NumPy arrays of centers
+    return (p2[0] - p1[0]) * (cy - p1[1]) - (p2[1] - p1[1]) * (cx - p1[0])
+
+
+# --------------------------------------------------
+# Bounded Per-track State
+# --------------------------------------------------
+class TrackTable:
+    """
+    Counting state of every live track in flat NumPy arrays, one row per
+    track, found through a track-id → row dict.
+
+    side       : last side of the line the track's center was on
+    has_side   : False until the track has been seen once on the line
+    last_seen  : frame the track was last detected in
+    crossed_at : frame the track crossed the line (-1 if it has not)
+    crossed    : True once the yellow flash after crossing has finished
+    counted    : zone events already counted for the track (ENTERED | EXITED bits)
+
+    Rows of tracks not seen for `ttl_frames` frames are freed and reused,
+    so memory stays flat over a long shift no matter how many IDs pass.
+    """
+
+    def __init__(self, ttl_frames: int = 90, capacity: int = 64):
+        self.ttl_frames = ttl_frames
+        self.rows = {}
+        self.evicted = 0
+        self._free = []
+        self.ids = np.empty(0, dtype=np.int64)
+        self.side = np.empty(0, dtype=np.float64)
+        self.has_side = np.empty(0, dtype=bool)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.crossed_at = np.empty(0, dtype=np.int64)
+        self.crossed = np.empty(0, dtype=bool)
+        self.counted = np.empty(0, dtype=np.int8)
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.ids)
+
+    def _grow(self, capacity: int):
+        old = self.capacity
+        for name, fill in (("ids", -1), ("side", 0), ("has_side", False),
+                           ("last_seen", 0), ("crossed_at", -1), ("crossed", False), ("counted", 0)):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.full(capacity - old, fill, dtype=array.dtype)]))
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def lookup(self, track_ids, frame_num: int) -> np.ndarray:
+        """Rows for `track_ids`, adding rows for tracks seen for the first time."""
+        rows = np.empty(len(track_ids), dtype=np.int64)
+        for i, track_id in enumerate(track_ids):
+            row = self.rows.get(track_id)
+            if row is None:
+                if not self._free:
+                    self._grow(self.capacity * 2)
+                row = self._free.pop()
+                self.rows[track_id] = row
+                self.ids[row] = track_id
+                self.has_side[row] = False
+                self.crossed_at[row] = -1
+                self.crossed[row] = False
+                self.counted[row] = 0
+            rows[i] = row
+        self.last_seen[rows] = frame_num
+        return rows
+
+    def evict(self, frame_num: int) -> int:
+        """Free the rows of tracks unseen for more than `ttl_frames` frames."""
+        stale = np.flatnonzero((self.ids >= 0) & (frame_num - self.last_seen > self.ttl_frames))
+        for row in stale.tolist():
+            del self.rows[int(self.ids[row])]
+            self.ids[row] = -1
+            self._free.append(row)
+        self.evicted += len(stale)
+        return len(stale)
+
+
+# --------------------------------------------------
+# Headless Line-crossing Counter
+# --------------------------------------------------
+class LineCrossingCounter:
+    """
+    Counts tracked objects crossing a line, or entering / leaving a polygon
+    zone, on a conveyor video, with no GUI.
+
+    region_points : [(x1, y1), (x2, y2)] line; objects moving to the positive
+                    side count as OUT, to the negative side as IN.
+                    3+ points: polygon zone; each track counts IN on its first
+                    entry and OUT on its first exit, and events carry the
+                    per-class occupancy of the zone.
+    source        : video file, RTSP URL or webcam index
+    model         : weights path or a YOLO instance. Tracker state lives on
+                    the model, so every counter needs its own instance.
+    output_path   : optional annotated video to write
+    track_ttl_frames : forget tracks not seen for this many frames
+    crop_to_roi   : zones only; run the detector on the zone's bounding box
+                    (plus `roi_margin` pixels) instead of the whole frame, at
+                    the scale the full frame would get with `imgsz`, so the
+                    skipped pixels are never computed
+    motion_gate   : optional MotionGate; on frames it judges static the
+                    detector is skipped and the last detected tracks are
+                    counted again where they were (nothing moved, so nothing
+                    crosses the line)
+
+    `events()` yields one count event per processed frame. Frames go through
+    a StreamingPipeline (capture / inference+counting / render+write
+    threads), so live sources drop stale frames instead of lagging.
+    `count()` is the counting step alone, for callers that run detection
+    and tracking themselves.
+    """
+
+    def __init__(self, region_points, source, model, classes=None, conf: float = 0.7, flash_frames: int = 4,
+                 output_path: str = None, return_frames: bool = False, tracker: str = "bytetrack.yaml",
+                 queue_size: int = 4, max_frame_age_ms: float = 500, report_interval: float = 0,
+                 track_ttl_frames: int = 90, crop_to_roi: bool = False, roi_margin: int = 32,
+                 imgsz: int = 640, motion_gate: MotionGate = None):
+        if len(region_points) < 2:
+            raise ValueError("You must select 2 points for a line or at least 3 points for a polygon zone.")
+        self.region_points = [tuple(int(v) for v in p) for p in region_points]
+        self.zone = PolygonZone(self.region_points) if len(self.region_points) >= 3 else None
+        self.crop_to_roi = crop_to_roi and self.zone is not None
+        self.roi_margin = roi_margin
+        self.imgsz = imgsz
+        self.motion_gate = motion_gate
+        self._last_tracks = None
+        self.source = source
+        self.model = YOLO(model, task="detect") if isinstance(model, str) else model
+        self.class_names = self.model.names
+        self.classes = classes
+        self.conf = conf
+        self.flash_frames = flash_frames
+        self.output_path = output_path
+        self.return_frames = return_frames
+        self.tracker = tracker
+        self.queue_size = queue_size
+        self.max_frame_age_ms = max_frame_age_ms
+        self.report_interval = report_interval
+
+        self.tracks = TrackTable(ttl_frames=track_ttl_frames)
+        self.class_counts_in = defaultdict(int)
+        self.class_counts_out = defaultdict(int)
+        self.pipeline = None
+
+    @property
+    def counts(self) -> dict:
+        return {"in": dict(self.class_counts_in), "out": dict(self.class_counts_out)}
+
+    # --- per-frame steps ---
+    def roi_crop(self, frame):
+        """
+        The part of `frame` to run the detector on, its (x, y) offset and the
+        inference size that keeps the crop at the full frame's scale.
+        """
+        if not self.crop_to_roi:
+            return frame, (0, 0), self.imgsz
+        x1, y1, x2, y2 = self.zone.crop_box(frame.shape, self.roi_margin)
+        scale = self.imgsz / max(frame.shape[:2])
+        imgsz = min(self.imgsz, -(-int(max(x2 - x1, y2 - y1) * scale) // 32) * 32)
+        return frame[y1:y2, x1:x2], (x1, y1), max(imgsz, 32)
+
+    def detect(self, frame):
+        """Run tracking on one frame; returns (boxes, confs, track_ids, class_indices)."""
+        image, (ox, oy), imgsz = self.roi_crop(frame)
+        results = self.model.track(image, persist=True, classes=self.classes, conf=self.conf,
+                                   imgsz=imgsz, tracker=self.tracker, verbose=False)
+        boxes = results[0].boxes if results else None
+        if boxes is None or boxes.id is None:
+            return [], [], [], []
+        xyxy = boxes.xyxy.cpu().numpy() + (ox, oy, ox, oy)
+        return (xyxy.tolist(), boxes.conf.cpu().tolist(),
+                boxes.id.int().cpu().tolist(), boxes.cls.int().cpu().tolist())
+
+    def count(self, boxes, confs, track_ids, class_indices, frame_num: int):
+        """
+        Update crossing state with one frame of tracked boxes. Sides of the
+        line (or inside / outside the zone), crossings and colors are
+        computed for all boxes at once.
+        Returns (event, drawing) where drawing feeds `annotate`.
+        """
+        confs = np.asarray(confs, dtype=np.float64).reshape(-1)
+        keep = confs >= self.conf  # skip low-confidence detections
+        confs = confs[keep]
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)[keep].astype(np.int64)
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)[keep]
+        class_indices = np.asarray(class_indices, dtype=np.int64).reshape(-1)[keep]
+        centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+
+        tracks = self.tracks
+        rows = tracks.lookup(track_ids.tolist(), frame_num)
+
+        # Default color: red, yellow flash after crossing, then green
+        crossed_before = tracks.crossed[rows]
+        just_crossed = (tracks.crossed_at[rows] >= 0) & ~crossed_before
+        flashing = just_crossed & (frame_num - tracks.crossed_at[rows] < self.flash_frames)
+        tracks.crossed[rows[just_crossed & ~flashing]] = True
+        color_index = np.where(flashing, 1, np.where(crossed_before, 2, 0))
+
+        crossings = []
+        occupancy = {}
+        if self.zone is not None and len(rows):
+            inside = self.zone.contains(centers)
+            sides = np.where(inside, 1.0, -1.0)
+            prev = tracks.side[rows]
+            counted = tracks.counted[rows]
+            moved = tracks.has_side[rows] & (prev * sides < 0)
+            entered = moved & inside & ((counted & ENTERED) == 0)
+            exited = moved & ~inside & ((counted & EXITED) == 0)
+            tracks.counted[rows[entered]] |= ENTERED
+            tracks.counted[rows[exited]] |= EXITED
+            tracks.side[rows] = sides
+            tracks.has_side[rows] = True
+            tracks.crossed_at[rows[entered | exited]] = frame_num
+            tracks.crossed[rows[entered | exited]] = False
+
+            for i in np.flatnonzero(entered | exited).tolist():
+                class_name = self.class_names[int(class_indices[i])]
+                direction = "in" if inside[i] else "out"
+                counts = self.class_counts_in if direction == "in" else self.class_counts_out
+                counts[class_name] += 1
+                crossings.append({"track_id": int(track_ids[i]), "class": class_name, "direction": direction})
+
+            occupancy = {self.class_names[int(c)]: int(n)
+                         for c, n in zip(*np.unique(class_indices[inside], return_counts=True))}
+
+        elif len(self.region_points) == 2 and len(rows):
+            p1, p2 = self.region_points
+            sides = get_side_of_line(p1, p2, centers[:, 0], centers[:, 1]).astype(np.float64)
+            prev = tracks.side[rows]
+            crossed = tracks.has_side[rows] & (prev * sides < 0) & ~tracks.crossed[rows]
+            tracks.side[rows] = sides
+            tracks.has_side[rows] = True
+            tracks.crossed_at[rows[crossed]] = frame_num
+
+            for i in np.flatnonzero(crossed).tolist():
+                class_name = self.class_names[int(class_indices[i])]
+                direction = "out" if prev[i] < 0 else "in"
+                counts = self.class_counts_out if direction == "out" else self.class_counts_in
+                counts[class_name] += 1
+                crossings.append({"track_id": int(track_ids[i]), "class": class_name, "direction": direction})
+
+        tracks.evict(frame_num)
+
+        event = {
+            "frame": frame_num,
+            "timestamp": time.time(),
+            "detections": len(boxes),
+            "crossings": crossings,
+            "counts_in": dict(self.class_counts_in),
+            "counts_out": dict(self.class_counts_out),
+            "occupancy": occupancy,
+        }
+        drawing = (
+            boxes.tolist(),
+            [COLORS[i] for i in color_index.tolist()],
+            [f"{self.class_names[c]} {conf:.2f}" for c, conf in zip(class_indices.tolist(), confs.tolist())],
+            [tuple(center) for center in centers.tolist()],
+        )
+        return event, drawing
+
+    def remember_tracks(self, detections, frame_num: int):
+        """Keep the latest detected tracks for `predict_tracks`."""
+        boxes, confs, track_ids, class_indices = detections
+        self._last_tracks = (np.asarray(boxes, dtype=np.float64).reshape(-1, 4),
+                             np.asarray(confs, dtype=np.float64).reshape(-1),
+                             np.asarray(track_ids, dtype=np.int64).reshape(-1),
+                             np.asarray(class_indices, dtype=np.int64).reshape(-1))
+
+    def predict_tracks(self, frame_num: int):
+        """
+        Tracks for a frame the motion gate skipped. The gate only skips
+        frames matching the last detected one, i.e. nothing moved, so the
+        last boxes stay where they were: extrapolating a velocity would push
+        a stopped tray across the line and count it.
+        """
+        if self._last_tracks is None:
+            return [], [], [], []
+        return self._last_tracks
+
+    def process_frame(self, frame, frame_num: int):
+        """detect (or, on a static scene, predict) + count for one frame."""
+        if self.motion_gate is not None and not self.motion_gate.should_detect(frame):
+            event, drawing = self.count(*self.predict_tracks(frame_num), frame_num)
+            event["detected"] = False
+            return event, drawing
+        detections = self.detect(frame)
+        if self.motion_gate is not None:
+            self.remember_tracks(detections, frame_num)
+        event, drawing = self.count(*detections, frame_num)
+        event["detected"] = True
+        return event, drawing
+
+    def annotate(self, frame, event, drawing):
+        """Draw the line or zone, boxes, centers and running counts onto `frame`."""
+        draw_boxes, draw_colors, draw_labels, draw_centers = drawing
+        if self.zone is not None:
+            self.zone.draw(frame, RED)
+        else:
+            cv2.line(frame, self.region_points[0], self.region_points[1], RED, 3)
+
+        draw_neon_corner_boxes(frame, draw_boxes, draw_colors, labels=draw_labels,
+                               label_colors=[WHITE] * len(draw_labels), label_offset=10)
+        for center, color in zip(draw_centers, draw_colors):
+            cv2.circle(frame, center, 4, color, -1)
+
+        y_offset = 30
+        counts_in, counts_out = event["counts_in"], event["counts_out"]
+        for cls in sorted(set(counts_in) | set(counts_out)):
+            cv2.putText(frame, f"{cls} IN: {counts_in.get(cls, 0)}  OUT: {counts_out.get(cls, 0)}",
+                        (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, GREEN, 2)
+            y_offset += 30
+        if self.zone is not None:
+            occupancy = ", ".join(f"{cls}: {n}" for cls, n in sorted(event["occupancy"].items()))
+            cv2.putText(frame, f"IN ZONE  {occupancy or '0'}",
+                        (30, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.8, YELLOW, 2)
+        return frame
+
+    # --- whole stream ---
+    def events(self):
+        """
+        Process the source and yield one count event per frame. Closing the
+        generator early stops the pipeline and releases the source.
+        """
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise RuntimeError(f"Unable to open video source: {self.source}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        writer = None
+        out = queue.Queue(maxsize=self.queue_size)
+        closed = threading.Event()
+        outcome = {}
+
+        def emit(item):
+            while not closed.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def render(frame, result, frame_num):
+            nonlocal writer
+            event, drawing = result
+            if self.output_path or self.return_frames:
+                self.annotate(frame, event, drawing)
+            if self.output_path:
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*"mp4v"),
+                                             fps if fps > 0 else 30, (w, h))
+                writer.write(frame)
+            if self.return_frames:
+                event["image"] = frame
+            return emit(event)
+
+        def drive():
+            try:
+                outcome["stats"] = self.pipeline.run()
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                emit(_END)
+
+        self.pipeline = StreamingPipeline(
+            cap, self.process_frame, render,
+            live=is_live_source(self.source),
+            queue_size=self.queue_size,
+            max_frame_age_ms=self.max_frame_age_ms,
+            report_interval=self.report_interval,
+            extra_stats=self._motion_stats,
+        )
+        thread = threading.Thread(target=drive, name="line-counter", daemon=True)
+        thread.start()
+        try:
+            while True:
+                event = out.get()
+                if event is _END:
+                    break
+                yield event
+            if "error" in outcome:
+                raise outcome["error"]
+        finally:
+            closed.set()
+            self.pipeline.stop()
+            thread.join(timeout=5)
+            cap.release()
+            if writer is not None:
+                writer.release()
+
+    def _motion_stats(self):
+        return {"motion": self.motion_gate.snapshot()} if self.motion_gate is not None else {}
+
+    def run(self) -> dict:
+        """Process the whole source and return the final counts."""
+        for _ in self.events():
+            pass
+        return self.counts
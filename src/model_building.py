@@ -87,6 +87,11 @@ def main():
 
             mlflow.pytorch.log_model(clean_model, "model")
             print("model logged in mlflow")
+
+            # Log the raw weights too, so the backend can hot-swap them with
+            # POST /admin/model/reload {"source": "runs:/<run_id>/weights/best.pt"}
+            mlflow.log_artifact(str(model_path), artifact_path="weights")
+            print(f"weights logged: runs:/{mlflow.active_run().info.run_id}/weights/best.pt")
   
 
             # End the run
@@ -0,0 +1,274 @@
+"""
+====================================
+ INT8 POST-TRAINING QUANTIZATION
+====================================
+
+This script turns the trained FP32 `model/best.pt` into an INT8 model for
+the CPU inference path, and refuses to ship it if it lost too much accuracy.
+
+It guides you through:
+- Validating the dataset with `data_ingestion.preprocess_data`
+- Sampling a calibration subset from the `train` split
+- Quantizing with ONNX Runtime (static QDQ) or OpenVINO (NNCF)
+- Comparing mAP and egg / empty-slot counts against FP32 on the `valid` split
+- Failing the stage when the accuracy drop passes the configured threshold
+
+Serve the result with `inference_backend: onnx_int8` (or `openvino_int8`)
+in inference_phams.yaml.
+"""
+# ----------------------------------------
+# Import Required Libraries
+# ----------------------------------------
+import json
+import os
+import random
+import shutil
+import sys
+
+import cv2
+import numpy as np
+import yaml
+from ultralytics import YOLO
+
+# Get directory where this script is located
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, BASE_DIR)
+from backend.inference_backends import ensure_exported, exported_weights_path
+from src.data_ingestion import preprocess_data
+
+# Build full path to parms.yaml
+yaml_path = os.path.join(BASE_DIR, "parms.yaml")
+with open(yaml_path) as f:
+    params = yaml.safe_load(f)
+
+with open(os.path.join(BASE_DIR, "inference_phams.yaml")) as f:
+    inference_params = yaml.safe_load(f)
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+# ----------------------------------------
+# Step 1: Build the Calibration Subset
+# ----------------------------------------
+def build_calibration_set(dataset_dir: str, num_images: int, seed: int = 0) -> str:
+    """
+    Sample `num_images` training images (never from `valid`, which is used
+    for the accuracy gate) and write a data yaml whose `val` entry points
+    at them, so exporters read it as their calibration split.
+    """
+    train_dir = os.path.join(dataset_dir, "train", "images")
+    images = sorted(f for f in os.listdir(train_dir) if f.lower().endswith(IMAGE_SUFFIXES))
+    random.Random(seed).shuffle(images)
+    images = [os.path.join(train_dir, f) for f in images[:num_images]]
+
+    list_path = os.path.join(dataset_dir, "calibration.txt")
+    with open(list_path, "w") as f:
+        f.write("\n".join(images) + "\n")
+
+    with open(os.path.join(dataset_dir, "data.yaml")) as f:
+        data = yaml.safe_load(f)
+    data.update(path=dataset_dir, train=list_path, val=list_path)
+    data.pop("test", None)
+
+    calibration_yaml = os.path.join(dataset_dir, "calibration.yaml")
+    with open(calibration_yaml, "w") as f:
+        yaml.safe_dump(data, f)
+    print(f"Calibration subset: {len(images)} images from {train_dir}")
+    return calibration_yaml
+
+
+def letterbox(image, imgsz: int):
+    """Resize keeping aspect ratio and pad to imgsz x imgsz like YOLO preprocessing."""
+    h, w = image.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    nh, nw = round(h * scale), round(w * scale)
+    resized = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = resized
+    return canvas
+
+
+class _CalibrationReader:
+    """Feeds calibration images to onnxruntime.quantization one at a time."""
+
+    def __init__(self, image_paths, input_name: str, imgsz: int):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._index = 0
+
+    def get_next(self):
+        if self._index >= len(self.image_paths):
+            return None
+        image = cv2.imread(self.image_paths[self._index])
+        self._index += 1
+        blob = letterbox(image, self.imgsz)[:, :, ::-1].transpose(2, 0, 1)  # BGR → RGB, HWC → CHW
+        blob = np.ascontiguousarray(blob, dtype=np.float32)[None] / 255.0
+        return {self.input_name: blob}
+
+    def rewind(self):
+        self._index = 0
+
+
+# ----------------------------------------
+# Step 2: Quantize
+# ----------------------------------------
+def quantize_onnx(weights_path: str, calibration_yaml: str, imgsz: int, batch: int) -> str:
+    """Static INT8 (QDQ, per-channel weights) quantization with ONNX Runtime."""
+    import onnxruntime
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    fp32_onnx = ensure_exported(weights_path, "onnx", imgsz=imgsz, batch=batch)
+    int8_onnx = exported_weights_path(weights_path, "onnx_int8")
+
+    prepared = int8_onnx.replace(".onnx", "_prep.onnx")
+    quant_pre_process(fp32_onnx, prepared, skip_symbolic_shape=True)
+
+    with open(calibration_yaml) as f:
+        list_path = yaml.safe_load(f)["val"]
+    with open(list_path) as f:
+        image_paths = [line.strip() for line in f if line.strip()]
+
+    input_name = onnxruntime.InferenceSession(prepared, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    quantize_static(
+        prepared,
+        int8_onnx,
+        _CalibrationReader(image_paths, input_name, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+    os.remove(prepared)
+    return int8_onnx
+
+
+def quantize_openvino(weights_path: str, calibration_yaml: str, imgsz: int, batch: int) -> str:
+    """INT8 quantization with OpenVINO / NNCF through the ultralytics exporter."""
+    model = YOLO(weights_path)
+    exported = model.export(format="openvino", int8=True, data=calibration_yaml,
+                            imgsz=imgsz, dynamic=True, batch=batch)
+    return str(exported)
+
+
+QUANTIZERS = {"onnx": quantize_onnx, "openvino": quantize_openvino}
+
+
+# ----------------------------------------
+# Step 3: Compare INT8 Against FP32
+# ----------------------------------------
+def count_per_class(model, image_paths, conf: float, classes) -> np.ndarray:
+    """(num_images, num_classes) detection counts at the serving confidence threshold."""
+    counts = []
+    for path in image_paths:
+        result = model.predict(path, conf=conf, classes=classes, verbose=False)[0]
+        counts.append(np.bincount(result.boxes.cls.cpu().numpy().astype(int), minlength=len(model.names)))
+    return np.array(counts).reshape(len(image_paths), len(model.names))
+
+
+def evaluate(fp32_weights: str, int8_weights: str, data_yaml: str, dataset_dir: str, imgsz: int, batch: int) -> dict:
+    """mAP on the valid split and per-image egg / empty-slot count error of INT8 vs FP32."""
+    fp32 = YOLO(fp32_weights, task="detect")
+    int8 = YOLO(int8_weights, task="detect")
+
+    report = {"fp32": fp32_weights, "int8": int8_weights}
+    for name, model in (("fp32", fp32), ("int8", int8)):
+        metrics = model.val(data=data_yaml, split="val", imgsz=imgsz, batch=batch, device="cpu",
+                            plots=False, verbose=False)
+        report[f"{name}_map50"] = float(metrics.box.map50)
+        report[f"{name}_map50_95"] = float(metrics.box.map)
+    report["map50_drop"] = report["fp32_map50"] - report["int8_map50"]
+    report["map50_95_drop"] = report["fp32_map50_95"] - report["int8_map50_95"]
+
+    valid_dir = os.path.join(dataset_dir, "valid", "images")
+    image_paths = sorted(os.path.join(valid_dir, f) for f in os.listdir(valid_dir) if f.lower().endswith(IMAGE_SUFFIXES))
+    conf = inference_params.get("confidence_threshold", 0.5)
+    classes = inference_params.get("classes_to_track")
+    fp32_counts = count_per_class(fp32, image_paths, conf, classes)
+    int8_counts = count_per_class(int8, image_paths, conf, classes)
+    error = np.abs(int8_counts - fp32_counts)
+
+    report["valid_images"] = len(image_paths)
+    report["count_error"] = {
+        fp32.names[c]: {
+            "mean_abs": float(error[:, c].mean()) if len(error) else 0.0,
+            "max_abs": int(error[:, c].max()) if len(error) else 0,
+        }
+        for c in (classes if classes is not None else range(len(fp32.names)))
+    }
+    report["images_with_count_change"] = int((error.sum(axis=1) > 0).sum())
+    return report
+
+
+def check_accuracy_gate(report: dict, max_map_drop: float, max_count_error: float) -> list:
+    """Return the reasons the INT8 model fails the gate (empty when it passes)."""
+    failures = []
+    if report["map50_95_drop"] > max_map_drop:
+        failures.append(f"mAP50-95 dropped by {report['map50_95_drop']:.4f} (limit {max_map_drop})")
+    for name, error in report["count_error"].items():
+        if error["mean_abs"] > max_count_error:
+            failures.append(f"mean {name} count error {error['mean_abs']:.3f} per tray (limit {max_count_error})")
+    return failures
+
+
+# ----------------------------------------
+# Step 4: Main Workflow
+# ----------------------------------------
+def main():
+    """
+    INT8 quantization stage: calibrate, quantize, evaluate, gate.
+    """
+    try:
+        data_yaml = os.path.join(BASE_DIR, params['data_yaml_path'])
+        dataset_dir = os.path.dirname(data_yaml)
+        weights_path = os.path.join(BASE_DIR, params.get('fp32_weights_path', "model/best.pt"))
+        backend = params.get('quantization_backend', "onnx")
+        imgsz = params.get('imgsz', 640)
+        batch = inference_params.get("max_batch_size", 8)
+
+        # --- Validate dataset ---
+        preprocess_data(dataset_dir)
+
+        # --- Calibrate & quantize ---
+        calibration_yaml = build_calibration_set(dataset_dir, params.get('calibration_images', 300))
+        int8_weights = QUANTIZERS[backend](weights_path, calibration_yaml, imgsz, batch)
+        print(f"INT8 model written to: {int8_weights}")
+
+        # --- Evaluate against FP32 on valid split ---
+        report = evaluate(weights_path, int8_weights, data_yaml, dataset_dir, imgsz, batch)
+        failures = check_accuracy_gate(
+            report,
+            max_map_drop=params.get('quantization_max_map_drop', 0.01),
+            max_count_error=params.get('quantization_max_count_error', 0.1),
+        )
+        report["passed"] = not failures
+        report["failures"] = failures
+
+        report_path = os.path.splitext(weights_path)[0] + "_int8_report.json"
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
+        print(f"Report saved at: {report_path}")
+
+        if failures:
+            # Never leave a rejected model where inference_backend would pick it up
+            if os.path.isdir(int8_weights):
+                shutil.rmtree(int8_weights)
+            elif os.path.exists(int8_weights):
+                os.remove(int8_weights)
+            raise RuntimeError("INT8 accuracy gate FAILED: " + "; ".join(failures))
+        print(f"INT8 accuracy gate passed. Serve it with inference_backend: {backend}_int8")
+
+    except Exception as e:
+        print(f"Error during INT8 quantization: {e}")
+        raise
+
+
+# ----------------------------------------
+# Entry Point
+# ----------------------------------------
+if __name__ == "__main__":
+    main()
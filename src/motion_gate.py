@@ -0,0 +1,72 @@
+# src/motion_gate.py
+
+import cv2
+import numpy as np
+
+
+# --------------------------------------------------
+# Motion-gated Detection
+# --------------------------------------------------
+class MotionGate:
+    """
+    Decides per frame whether the detector needs to run at all.
+
+    Each frame is shrunk to `width` pixels wide, converted to grayscale and
+    blurred, then compared with the frame the detector last ran on. When
+    less than `min_changed_fraction` of the pixels changed by more than
+    `pixel_threshold` gray levels the scene is treated as static (stopped
+    conveyor) and detection is skipped; callers keep the last detected
+    tracks where they were instead. Comparing against the last *detected* frame means
+    slow drift still triggers a detection once it adds up, and
+    `max_skip_frames` forces one at least that often regardless.
+    """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25, min_changed_fraction: float = 0.002,
+                 max_skip_frames: int = 15):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.max_skip_frames = max_skip_frames
+        self.frames = 0
+        self.detected = 0
+        self.skipped = 0
+        self.last_change = 0.0
+        self._reference = None
+        self._since_detection = 0
+
+    def _signature(self, frame):
+        h, w = frame.shape[:2]
+        height = max(int(h * self.width / w), 1)
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def should_detect(self, frame) -> bool:
+        """True when the scene changed enough since the last detection."""
+        signature = self._signature(frame)
+        self.frames += 1
+
+        if self._reference is None or self._reference.shape != signature.shape \
+                or self._since_detection >= self.max_skip_frames:
+            detect = True
+        else:
+            diff = cv2.absdiff(signature, self._reference)
+            self.last_change = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+            detect = self.last_change >= self.min_changed_fraction
+
+        if detect:
+            self._reference = signature
+            self._since_detection = 0
+            self.detected += 1
+        else:
+            self._since_detection += 1
+            self.skipped += 1
+        return detect
+
+    def snapshot(self) -> dict:
+        return {
+            "frames": self.frames,
+            "detected": self.detected,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+        }
@@ -0,0 +1,260 @@
+# src/stream_multiplexer.py
+
+import queue
+import threading
+import time
+
+import cv2
+import yaml
+from ultralytics import YOLO
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+
+from src.line_counter import LineCrossingCounter
+from src.motion_gate import MotionGate
+from src.video_pipeline import StageStats, is_live_source
+
+
+def make_tracker(tracker: str = "bytetrack.yaml"):
+    """A standalone ultralytics tracker (BYTETrack / BoT-SORT) for one stream."""
+    with open(check_yaml(tracker)) as f:
+        cfg = IterableSimpleNamespace(**yaml.safe_load(f))
+    return TRACKER_MAP[cfg.tracker_type](args=cfg)
+
+
+class _Stream:
+    """One camera: its capture thread, frame queue, tracker and counter."""
+
+    def __init__(self, name, source, counter, tracker, queue_size):
+        self.name = name
+        self.source = source
+        self.live = is_live_source(source)
+        self.counter = counter
+        self.tracker = tracker
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.capture_stats = StageStats()
+        self.stats = StageStats()
+        self.ended = False
+        self.thread = None
+
+
+# --------------------------------------------------
+# Multi-camera Multiplexer
+# --------------------------------------------------
+class StreamMultiplexer:
+    """
+    Counts eggs on several conveyor cameras in one process.
+
+    Every source gets its own capture thread, tracker and LineCrossingCounter
+    (so track IDs and class_counts_in/out never mix between cameras), while
+    detection runs once per round on a batch holding the next frame of every
+    stream that has one, up to `max_batch_size` frames per model call.
+
+    streams : {name: (source, region_points)}, a 2-point line or a polygon zone
+    model   : weights path or a YOLO instance, shared by all streams
+              (it is only used for predict, never track)
+
+    Live sources drop their oldest queued frame when detection falls behind;
+    files are read with back-pressure. With `motion_gating`, each stream has
+    its own MotionGate (`motion_options` are its arguments): static frames
+    skip the batch and keep their last detected tracks, so idle lines cost
+    almost nothing.
+    """
+
+    def __init__(self, streams: dict, model, classes=None, conf: float = 0.7, max_batch_size: int = 8,
+                 tracker: str = "bytetrack.yaml", queue_size: int = 2, report_interval: float = 0,
+                 track_ttl_frames: int = 90, crop_to_roi: bool = False, motion_gating: bool = False,
+                 motion_options: dict = None):
+        self.model = YOLO(model, task="detect") if isinstance(model, str) else model
+        self.classes = classes
+        self.conf = conf
+        self.max_batch_size = max_batch_size
+        self.report_interval = report_interval
+        self.streams = {
+            name: _Stream(
+                name, source,
+                LineCrossingCounter(region_points, source, self.model, classes=classes, conf=conf,
+                                    track_ttl_frames=track_ttl_frames, crop_to_roi=crop_to_roi,
+                                    motion_gate=MotionGate(**(motion_options or {})) if motion_gating else None),
+                make_tracker(tracker),
+                queue_size,
+            )
+            for name, (source, region_points) in streams.items()
+        }
+        self.batches = 0
+        self.batched_frames = 0
+        self.inference_seconds = 0.0
+        self.aggregate = StageStats()
+        self._frame_ready = threading.Event()
+        self._stop = threading.Event()
+        self._started_at = None
+        self._last_report = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def counts(self) -> dict:
+        """Per-stream IN/OUT counts."""
+        return {name: stream.counter.counts for name, stream in self.streams.items()}
+
+    def stats(self) -> dict:
+        """Per-stream and aggregate throughput plus batching efficiency."""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return {
+            "streams": {
+                name: {
+                    "capture_fps": round(stream.capture_stats.fps, 2),
+                    "fps": round(stream.stats.fps, 2),
+                    "processed": stream.stats.processed,
+                    "dropped": stream.stats.dropped,
+                    "queue_depth": stream.frames.qsize(),
+                    **({"motion": stream.counter.motion_gate.snapshot()}
+                       if stream.counter.motion_gate is not None else {}),
+                }
+                for name, stream in self.streams.items()
+            },
+            "aggregate": {
+                "fps": round(self.aggregate.fps, 2),
+                "processed": self.aggregate.processed,
+                "average_fps": round(self.aggregate.processed / elapsed, 2) if elapsed else 0.0,
+                "batches": self.batches,
+                "mean_batch_size": round(self.batched_frames / self.batches, 2) if self.batches else 0.0,
+                "ms_per_batch": round(1000 * self.inference_seconds / self.batches, 2) if self.batches else 0.0,
+            },
+        }
+
+    def events(self):
+        """
+        Yield count events from all streams as they are processed; each
+        event is a LineCrossingCounter event with an extra "stream" key.
+        """
+        self._started_at = time.monotonic()
+        for stream in self.streams.values():
+            stream.thread = threading.Thread(target=self._capture_loop, args=(stream,),
+                                             name=f"capture-{stream.name}", daemon=True)
+            stream.thread.start()
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch()
+                if batch is None:
+                    break
+                if not batch:
+                    self._frame_ready.wait(timeout=0.05)
+                    self._frame_ready.clear()
+                    continue
+                for start in range(0, len(batch), self.max_batch_size):
+                    yield from self._process(batch[start:start + self.max_batch_size])
+                self._maybe_report()
+        finally:
+            self._stop.set()
+            for stream in self.streams.values():
+                stream.thread.join(timeout=5)
+
+    def run(self) -> dict:
+        """Process every stream to the end and return the per-stream counts."""
+        for _ in self.events():
+            pass
+        return self.counts()
+
+    # --- internals ---
+    def _capture_loop(self, stream):
+        cap = cv2.VideoCapture(stream.source)
+        frame_num = 0
+        try:
+            while cap.isOpened() and not self._stop.is_set():
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_num += 1
+                stream.capture_stats.record(time.perf_counter() - start)
+                self._put(stream, (frame_num, frame))
+        finally:
+            cap.release()
+            stream.ended = True
+            self._frame_ready.set()
+
+    def _put(self, stream, item):
+        while not self._stop.is_set():
+            try:
+                stream.frames.put(item, block=not stream.live, timeout=0.1)
+                self._frame_ready.set()
+                return
+            except queue.Full:
+                if stream.live:
+                    try:
+                        stream.frames.get_nowait()
+                        stream.stats.drop()
+                    except queue.Empty:
+                        pass
+
+    def _next_batch(self):
+        """
+        The next frame of every stream that has one (one per stream keeps
+        each tracker's frames in order). None once every stream has ended.
+        """
+        batch = []
+        finished = True
+        for stream in self.streams.values():
+            try:
+                frame_num, frame = stream.frames.get_nowait()
+            except queue.Empty:
+                finished = finished and stream.ended
+                continue
+            finished = False
+            batch.append((stream, frame_num, frame))
+        return None if finished else batch
+
+    def _process(self, batch):
+        # Static scenes skip the detector: their last detected tracks stay in place
+        detect = []
+        for stream, frame_num, frame in batch:
+            gate = stream.counter.motion_gate
+            if gate is None or gate.should_detect(frame):
+                detect.append((stream, frame_num, frame))
+                continue
+            event, _ = stream.counter.count(*stream.counter.predict_tracks(frame_num), frame_num)
+            event.update(stream=stream.name, detected=False)
+            stream.stats.record(0.0)
+            self.aggregate.record(0.0)
+            yield event
+        if not detect:
+            return
+        batch = detect
+
+        # Zones with crop_to_roi only send their lane's bounding box to the detector
+        crops = [stream.counter.roi_crop(frame) for stream, _, frame in batch]
+        start = time.perf_counter()
+        results = self.model.predict([image for image, _, _ in crops], conf=self.conf, classes=self.classes,
+                                     imgsz=max(imgsz for _, _, imgsz in crops), verbose=False)
+        elapsed = time.perf_counter() - start
+        self.batches += 1
+        self.batched_frames += len(batch)
+        self.inference_seconds += elapsed
+
+        for (stream, frame_num, _), (image, offset, _), result in zip(batch, crops, results):
+            tracks = stream.tracker.update(result.boxes.cpu().numpy(), image)
+            if len(tracks):
+                detections = (tracks[:, :4] + (offset + offset), tracks[:, 5],
+                              tracks[:, 4].astype(int), tracks[:, 6].astype(int))
+            else:
+                detections = ([], [], [], [])
+            if stream.counter.motion_gate is not None:
+                stream.counter.remember_tracks(detections, frame_num)
+            event, _ = stream.counter.count(*detections, frame_num)
+            event.update(stream=stream.name, detected=True)
+            stream.stats.record(elapsed / len(batch))
+            self.aggregate.record(elapsed / len(batch))
+            yield event
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if not self.report_interval or now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        stats = self.stats()
+        per_stream = " | ".join(f"{name} {s['fps']:.1f} fps (q {s['queue_depth']}, dropped {s['dropped']})"
+                                for name, s in stats["streams"].items())
+        aggregate = stats["aggregate"]
+        print(f"{per_stream} || total {aggregate['fps']:.1f} fps, batch {aggregate['mean_batch_size']:.1f}")
@@ -0,0 +1,246 @@
+# src/video_pipeline.py
+
+import queue
+import threading
+import time
+from collections import deque
+
+
+LIVE_PREFIXES = ("rtsp://", "rtmp://", "http://", "https://", "udp://", "tcp://")
+
+# Marks the end of the stream in a stage queue
+_END = object()
+
+
+def is_live_source(source) -> bool:
+    """Webcam indexes and network streams are live; anything else is a file."""
+    if isinstance(source, int):
+        return True
+    source = str(source)
+    return source.isdigit() or source.lower().startswith(LIVE_PREFIXES)
+
+
+# --------------------------------------------------
+# Per-stage Throughput
+# --------------------------------------------------
+class StageStats:
+    """Frames processed / dropped by one stage and its FPS over a sliding window."""
+
+    def __init__(self, window_seconds: float = 2.0):
+        self.window_seconds = window_seconds
+        self.processed = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            self.processed += 1
+            self.busy_seconds += busy_seconds
+            self._times.append(now)
+            while now - self._times[0] > self.window_seconds:
+                self._times.popleft()
+
+    def drop(self, count: int = 1):
+        with self._lock:
+            self.dropped += count
+
+    @property
+    def fps(self) -> float:
+        with self._lock:
+            if len(self._times) < 2:
+                return 0.0
+            span = self._times[-1] - self._times[0]
+            return (len(self._times) - 1) / span if span > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "fps": round(self.fps, 2),
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "ms_per_frame": round(1000 * self.busy_seconds / self.processed, 2) if self.processed else 0.0,
+        }
+
+
+# --------------------------------------------------
+# Pipelined Capture → Inference → Render
+# --------------------------------------------------
+class StreamingPipeline:
+    """
+    Runs a video through three stages, each on its own thread, joined by
+    bounded queues so a slow stage never stalls the others:
+
+        capture   : cap.read() as fast as the source delivers frames
+        inference : infer_fn(frame, frame_num) -> result (detection, tracking, counting)
+        render    : render_fn(frame, result, frame_num) -> bool (draw, write, show);
+                    returning False stops the pipeline
+
+    Render runs on the thread that calls `run`, so cv2.imshow stays on the
+    main thread.
+
+    Live sources (webcam / RTSP) must not fall behind the camera: when a
+    queue is full the oldest frame is dropped to make room for the newest,
+    and frames older than `max_frame_age_ms` are skipped before inference.
+    Files are processed frame by frame, with back-pressure instead of drops.
+    `extra_stats()` may add entries (e.g. detector skip rate) to `stats`.
+    """
+
+    def __init__(self, capture, infer_fn, render_fn, live: bool = False, queue_size: int = 4,
+                 max_frame_age_ms: float = 500, report_interval: float = 5.0, extra_stats=None):
+        self.capture = capture
+        self.infer_fn = infer_fn
+        self.render_fn = render_fn
+        self.live = live
+        self.max_frame_age = max_frame_age_ms / 1000 if max_frame_age_ms else None
+        self.report_interval = report_interval
+        self.extra_stats = extra_stats
+
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.stages = {name: StageStats() for name in ("capture", "inference", "render")}
+
+        self._stop = threading.Event()
+        self._error = None
+        self._last_report = time.monotonic()
+
+    def stats(self) -> dict:
+        """Per-stage FPS / drops and current queue depths."""
+        stats = {
+            "stages": {name: stage.snapshot() for name, stage in self.stages.items()},
+            "queues": {
+                "frames": {"depth": self.frames.qsize(), "max": self.frames.maxsize},
+                "results": {"depth": self.results.qsize(), "max": self.results.maxsize},
+            },
+        }
+        if self.extra_stats is not None:
+            stats.update(self.extra_stats())
+        return stats
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self) -> dict:
+        """Process the whole stream; returns the final stats."""
+        threads = [
+            threading.Thread(target=self._guard, args=(self._capture_loop,), name="capture", daemon=True),
+            threading.Thread(target=self._guard, args=(self._inference_loop,), name="inference", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self._render_loop()
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+        if self._error is not None:
+            raise self._error
+        return self.stats()
+
+    # --- stages ---
+    def _capture_loop(self):
+        frame_num = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            frame_num += 1
+            self.stages["capture"].record(time.perf_counter() - start)
+            self._put(self.frames, (frame_num, time.monotonic(), frame), self.stages["inference"])
+        self._put_end(self.frames)
+
+    def _inference_loop(self):
+        while True:
+            item = self._get(self.frames)
+            if item is _END:
+                break
+            frame_num, captured_at, frame = item
+            if self.live and self.max_frame_age and time.monotonic() - captured_at > self.max_frame_age:
+                self.stages["inference"].drop()
+                continue
+            start = time.perf_counter()
+            result = self.infer_fn(frame, frame_num)
+            self.stages["inference"].record(time.perf_counter() - start)
+            self._put(self.results, (frame_num, frame, result), self.stages["render"])
+        self._put_end(self.results)
+
+    def _render_loop(self):
+        while True:
+            item = self._get(self.results)
+            if item is _END:
+                break
+            frame_num, frame, result = item
+            start = time.perf_counter()
+            keep_going = self.render_fn(frame, result, frame_num)
+            self.stages["render"].record(time.perf_counter() - start)
+            self._maybe_report()
+            if keep_going is False:
+                break
+
+    # --- queue helpers ---
+    def _put(self, q, item, consumer_stats):
+        """Live: drop the oldest queued frame when full. Files: wait for room."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, block=not self.live, timeout=0.1)
+                return
+            except queue.Full:
+                if self.live:
+                    try:
+                        q.get_nowait()
+                        consumer_stats.drop()
+                    except queue.Empty:
+                        pass
+
+    def _put_end(self, q):
+        while not self._stop.is_set():
+            try:
+                q.put(_END, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _guard(self, loop):
+        try:
+            loop()
+        except Exception as e:
+            self._error = e
+            self._stop.set()
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if not self.report_interval or now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        print(format_stats(self.stats()))
+
+
+def format_stats(stats: dict) -> str:
+    """One-line summary of per-stage FPS, drops and queue depths."""
+    stages, queues = stats["stages"], stats["queues"]
+    line = (
+        f"capture {stages['capture']['fps']:.1f} fps"
+        f" | frames q {queues['frames']['depth']}/{queues['frames']['max']}"
+        f" | inference {stages['inference']['fps']:.1f} fps"
+        f" ({stages['inference']['ms_per_frame']:.0f} ms, dropped {stages['inference']['dropped']})"
+        f" | results q {queues['results']['depth']}/{queues['results']['max']}"
+        f" | render {stages['render']['fps']:.1f} fps (dropped {stages['render']['dropped']})"
+    )
+    if "motion" in stats:
+        # Effective FPS counts every frame handled; the detector only ran on the rest
+        skip_rate = stats["motion"]["skip_rate"]
+        line += (f" | detector skipped {100 * skip_rate:.0f}%"
+                 f" (effective {stages['inference']['fps']:.1f} fps,"
+                 f" detector {stages['inference']['fps'] * (1 - skip_rate):.1f} runs/s)")
+    return line
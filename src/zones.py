@@ -0,0 +1,49 @@
+# src/zones.py
+
+import cv2
+import numpy as np
+
+
+# --------------------------------------------------
+# Polygon Region of Interest
+# --------------------------------------------------
+class PolygonZone:
+    """
+    A polygon region (e.g. the conveyor lane) with its inside/outside test
+    precomputed as a boolean mask over the polygon's bounding box.
+
+    `contains` is then a single fancy-indexing lookup for all points of a
+    frame, and `crop_box` gives the pixel area worth running the detector on.
+    """
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(self.points) < 3:
+            raise ValueError("A polygon zone needs at least 3 points.")
+        self.x1, self.y1 = (int(v) for v in self.points.min(axis=0))
+        self.x2, self.y2 = (int(v) for v in self.points.max(axis=0))
+
+        mask = np.zeros((self.y2 - self.y1 + 1, self.x2 - self.x1 + 1), dtype=np.uint8)
+        cv2.fillPoly(mask, [self.points - (self.x1, self.y1)], 1)
+        self.mask = mask.astype(bool)
+
+    def contains(self, points) -> np.ndarray:
+        """Boolean array: which (N, 2) x, y points fall inside the polygon."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        x = points[:, 0] - self.x1
+        y = points[:, 1] - self.y1
+        h, w = self.mask.shape
+        valid = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        inside = np.zeros(len(points), dtype=bool)
+        inside[valid] = self.mask[y[valid], x[valid]]
+        return inside
+
+    def crop_box(self, frame_shape, margin: int = 0):
+        """Bounding box of the zone plus `margin` pixels, clipped to the frame."""
+        h, w = frame_shape[:2]
+        return (max(self.x1 - margin, 0), max(self.y1 - margin, 0),
+                min(self.x2 + margin + 1, w), min(self.y2 + margin + 1, h))
+
+    def draw(self, frame, color, thickness: int = 3):
+        cv2.polylines(frame, [self.points], True, color, thickness)
+        return frame